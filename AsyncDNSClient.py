@@ -0,0 +1,490 @@
+import asyncio
+import itertools
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple, Iterator
+
+from cache import AnswerCache
+from config import BULK_CONCURRENCY, MAX_SENDING_WAIT_TIME_SECONDS, MAX_RECEIVING_WAIT_TIME_SECONDS, TCP_POOL_SIZE, \
+    TCP_IDLE_TIMEOUT_SECONDS, EDNS_UDP_PAYLOAD_SIZE, GLUE_PREFETCH_TIMEOUT_SECONDS, STALE_CLIENT_TIMEOUT_SECONDS, \
+    UDP_SOCKET_MAX_QUERIES, CACHE_REFRESH_TIMEOUT_SECONDS
+from DNSClient import DNSClient, BaseResolver, BulkQuery, Resolution, GLUE_ERRORS, GLUE_QTYPE, RESOLUTION_ERRORS
+from models import QTYPE, QCLASS, DomainName, RCODE
+from models.constants import ADDRESS_FAMILY, PORT, TCP_LENGTH_FIELD_SIZE, MAX_UDP_PAYLOAD_SIZE
+from models.exceptions import MalformedDNSResponseException, HostRetrievalException, DNSError, DNSNameError
+from models.question import Question
+from models.rrs import RR
+from request.request import Request, Query
+from response.response import Response
+from transport import QueryKey, query_key, claim_id
+from upstream import UpstreamPolicy
+from utils import check_tries, check_response, Authority, AsyncSingleFlight
+
+
+class DNSProtocol(asyncio.DatagramProtocol):
+    transport: Optional[asyncio.DatagramTransport]
+    pending: Dict[QueryKey, asyncio.Future]
+    sent: int
+
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+        self.sent = 0
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        try:
+            response = Response(data, lazy=True)
+            key = addr[0], response.header.id, tuple(response.question)
+        except MalformedDNSResponseException:
+            return
+        future = self.pending.get(key)
+        if future is not None and not future.done():
+            future.set_result(response)
+
+    def error_received(self, exc: Exception):
+        pass
+
+    def connection_lost(self, exc: Optional[Exception]):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError('Connection lost'))
+        self.transport = None
+
+
+class AsyncDNSClient(DNSClient):
+    """DNSClient running resolutions as coroutines on a single asyncio event loop.
+
+    All resolutions share one UDP endpoint, the delegation table and the answer cache. Like UDPTransport, the
+    endpoint is replaced by one on a new source port every UDP_SOCKET_MAX_QUERIES queries.
+    """
+    _protocol: Optional[DNSProtocol]
+    _loop: Optional[asyncio.AbstractEventLoop]
+    async_flights: AsyncSingleFlight
+    async_query_flights: AsyncSingleFlight
+    tcp_pool_size: int
+    tcp_idle_timeout: float
+    _tcp_connections: OrderedDict[str, 'AsyncTCPConnection']
+    _glue_tasks: Dict[DomainName, asyncio.Task]
+    _refresh_tasks: Dict[Question, asyncio.Task]
+
+    def __init__(self, rd: bool = True, required_aa: bool = False, cache: Optional[AnswerCache] = None,
+                 hedge_delay: Optional[float] = None, edns_payload_size: Optional[int] = EDNS_UDP_PAYLOAD_SIZE,
+                 upstreams: Optional[List[str]] = None, upstream_policy: UpstreamPolicy = UpstreamPolicy.LOWEST_SRTT):
+        super().__init__(rd, required_aa, cache, hedge_delay, edns_payload_size, upstreams, upstream_policy)
+        self._protocol = None
+        self._loop = None
+        self.async_flights = AsyncSingleFlight()
+        self.async_query_flights = AsyncSingleFlight()
+        self.tcp_pool_size = TCP_POOL_SIZE
+        self.tcp_idle_timeout = TCP_IDLE_TIMEOUT_SECONDS
+        self._tcp_connections = OrderedDict()
+        self._glue_tasks = {}
+        self._refresh_tasks = {}
+
+    async def retrieve(self, name: str, qtype: QTYPE = QTYPE.A, qclass: QCLASS = QCLASS.IN,
+                       deadline: Optional[float] = None) -> Response:
+        question = Question(name, qtype, qclass)
+        cached = self.lookup_cache(question)
+        if cached is not None:
+            return cached
+        stale = self.lookup_stale(question)
+        if stale is None:
+            return await self.async_flights.do(question, lambda: self._resolve(question, deadline), deadline)
+        if self.serve_stale_now(question):
+            return self.check_name_error(question, stale)
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.refresh(question)), STALE_CLIENT_TIMEOUT_SECONDS)
+        except (asyncio.TimeoutError, *RESOLUTION_ERRORS):
+            return self.check_name_error(question, stale)
+
+    async def _resolve(self, question: Question, deadline: Optional[float]) -> Response:
+        res = AsyncResolver(self, question.qname.name, question.qtype, question.qclass, deadline)
+        try:
+            response = await res.resolve()
+        except DNSNameError as e:
+            self.store_name_error(question, e)
+            raise
+        self.cache.put(question, response)
+        return response
+
+    async def retrieve_many(self, queries: Iterable[BulkQuery], concurrency: int = BULK_CONCURRENCY,
+                            deadline: Optional[float] = None) -> AsyncIterator[Resolution]:
+        pending = set()
+        try:
+            for query in queries:
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+                pending.add(asyncio.ensure_future(self._retrieve_item(deadline, *query)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _retrieve_item(self, deadline: Optional[float], name: str, qtype: QTYPE = QTYPE.A,
+                             qclass: QCLASS = QCLASS.IN) -> Resolution:
+        question = Question(name, qtype, qclass)
+        try:
+            return Resolution(question, await self.retrieve(name, qtype, qclass, deadline))
+        except Exception as e:
+            return Resolution(question, error=e)
+
+    def serve_stale_now(self, question: Question) -> bool:
+        task = self._refresh_tasks.get(question)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            return True
+        return super().serve_stale_now(question)
+
+    def refresh(self, question: Question) -> asyncio.Task:
+        task = self._refresh_tasks.get(question)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = self._refresh_tasks[question] = asyncio.ensure_future(self.async_flights.do(
+                question, lambda: self._resolve(question, CACHE_REFRESH_TIMEOUT_SECONDS), CACHE_REFRESH_TIMEOUT_SECONDS))
+
+            def done(t: asyncio.Task):
+                if self._refresh_tasks.get(question) is t:
+                    self._refresh_tasks.pop(question)
+                if not t.cancelled():
+                    self.record_refresh(question, t.exception())
+            task.add_done_callback(done)
+        return task
+
+    def glue_future(self, authority: Authority) -> asyncio.Task:
+        task = self._glue_tasks.get(authority.nsdname)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = self._glue_tasks[authority.nsdname] = asyncio.ensure_future(self.resolve_glue(authority))
+            task.add_done_callback(lambda t: self._glue_tasks.pop(authority.nsdname, None)
+                                   if self._glue_tasks.get(authority.nsdname) is t else None)
+        return task
+
+    async def resolve_glue(self, authority: Authority, timeout: float = GLUE_PREFETCH_TIMEOUT_SECONDS) \
+            -> Optional[str]:
+        try:
+            response = await self.retrieve(authority.nsdname.name, GLUE_QTYPE, QCLASS.IN, timeout)
+        except GLUE_ERRORS:
+            return None
+        return self.store_glue(authority, response)
+
+    async def endpoint(self) -> DNSProtocol:
+        loop = asyncio.get_running_loop()
+        if self._protocol is None or self._protocol.transport is None or self._loop is not loop \
+                or self._protocol.sent >= UDP_SOCKET_MAX_QUERIES:
+            previous = self._protocol if self._loop is loop else None
+            transport, protocol = await loop.create_datagram_endpoint(DNSProtocol, family=ADDRESS_FAMILY)
+            if self._protocol is not previous and self._loop is loop:
+                # Another resolution replaced the endpoint while this one was being created.
+                transport.close()
+                return self._protocol
+            self._protocol = protocol
+            self._loop = loop
+            self.retire(previous)
+        return self._protocol
+
+    def retire(self, protocol: Optional[DNSProtocol]) -> None:
+        """Closes a replaced endpoint once no query sent from it is waiting for a response."""
+        if protocol is not None and protocol is not self._protocol and not protocol.pending \
+                and protocol.transport is not None:
+            protocol.transport.close()
+
+    async def query_udp(self, addresses: List[str], request: Request, timeout: float) -> Tuple[Response, str]:
+        protocol = await self.endpoint()
+        loop = asyncio.get_running_loop()
+        futures: Dict[asyncio.Future, str] = {}
+        sent_at: Dict[asyncio.Future, float] = {}
+        deadline = loop.time() + timeout
+        try:
+            for i, address in enumerate(addresses):
+                future = loop.create_future()
+                claim_id(request, lambda r: query_key(address, r) in protocol.pending)
+                protocol.pending[query_key(address, request)] = future
+                futures[future] = address
+                sent_at[future] = loop.time()
+                protocol.transport.sendto(bytes(request), (address, PORT))
+                protocol.sent += 1
+                request.mark_sent()
+                remaining = deadline - loop.time()
+                if self.hedge_delay is None or i == len(addresses) - 1:
+                    wait = remaining
+                else:
+                    wait = min(self.hedge_delay, remaining)
+                done, _ = await asyncio.wait(futures, timeout=max(wait, 0), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    response = future.result()
+                    if not check_response(request, response):
+                        raise MalformedDNSResponseException('Wrong response')
+                    self.server_stats.record_rtt(futures[future], loop.time() - sent_at[future])
+                    return response, futures[future]
+                if loop.time() >= deadline:
+                    break
+            for address in futures.values():
+                self.server_stats.record_failure(address)
+            raise TimeoutError()
+        finally:
+            for future, address in futures.items():
+                key = query_key(address, request)
+                if protocol.pending.get(key) is future:
+                    protocol.pending.pop(key)
+                future.cancel()
+            self.retire(protocol)
+
+    async def query_tcp(self, address: str, request: Request, timeout: float = MAX_RECEIVING_WAIT_TIME_SECONDS) \
+            -> Response:
+        connection = await self.tcp_connection(address, min(timeout, MAX_SENDING_WAIT_TIME_SECONDS))
+        return await connection.query(request, timeout)
+
+    async def tcp_connection(self, address: str, connect_timeout: float) -> 'AsyncTCPConnection':
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        for other in list(self._tcp_connections.values()):
+            if other.closed or other.loop is not loop or (other.idle and now - other.last_used > self.tcp_idle_timeout):
+                self._tcp_connections.pop(other.address)
+                other.close()
+        connection = self._tcp_connections.get(address)
+        if connection is not None:
+            self._tcp_connections.move_to_end(address)
+            return connection
+        connection = await AsyncTCPConnection.open(address, connect_timeout)
+        previous = self._tcp_connections.get(address)
+        if previous is not None and not previous.closed and previous.loop is loop:
+            # Another resolution connected to the same server meanwhile; share its connection.
+            connection.close()
+            self._tcp_connections.move_to_end(address)
+            return previous
+        if previous is not None:
+            self._tcp_connections.pop(address)
+            previous.close()
+        self._tcp_connections[address] = connection
+        for other in list(self._tcp_connections.values()):
+            if len(self._tcp_connections) <= self.tcp_pool_size:
+                break
+            if other is not connection and other.idle:
+                self._tcp_connections.pop(other.address)
+                other.close()
+        return connection
+
+    def close(self):
+        super().close()
+        if self._protocol is not None and self._protocol.transport is not None and not self._loop.is_closed():
+            self._protocol.transport.close()
+        self._protocol = None
+        for connection in self._tcp_connections.values():
+            if not connection.loop.is_closed():
+                connection.close()
+        self._tcp_connections.clear()
+        for task in itertools.chain(self._glue_tasks.values(), self._refresh_tasks.values()):
+            if not task.get_loop().is_closed():
+                task.cancel()
+        self._glue_tasks.clear()
+        self._refresh_tasks.clear()
+
+
+class AsyncTCPConnection:
+    """Persistent TCP connection to a nameserver with pipelined queries matched to responses by id (RFC 7766)."""
+    address: str
+    loop: asyncio.AbstractEventLoop
+    last_used: float
+    closed: bool
+    _pending: Dict[int, Tuple[Request, asyncio.Future]]
+
+    def __init__(self, address: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.address = address
+        self.loop = asyncio.get_running_loop()
+        self.last_used = self.loop.time()
+        self.closed = False
+        self._reader = reader
+        self._writer = writer
+        self._pending = {}
+        self._read_task = asyncio.ensure_future(self._read_loop())
+
+    @classmethod
+    async def open(cls, address: str, timeout: float) -> 'AsyncTCPConnection':
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(address, PORT), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError()
+        return cls(address, reader, writer)
+
+    @property
+    def idle(self) -> bool:
+        return not self._pending
+
+    async def query(self, request: Request, timeout: float) -> Response:
+        if self.closed:
+            raise ConnectionError('Connection closed')
+        future = self.loop.create_future()
+        claim_id(request, lambda r: r.id in self._pending)
+        self._pending[request.id] = (request, future)
+        self.last_used = self.loop.time()
+        try:
+            req = bytes(request)
+            self._writer.write(len(req).to_bytes(TCP_LENGTH_FIELD_SIZE, 'big') + req)
+            await self._writer.drain()
+            request.mark_sent()
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError()
+        except OSError as e:
+            # A failed write leaves the stream out of sync for every query pipelined after this one.
+            self.close(e)
+            raise
+        finally:
+            if self._pending.get(request.id, (None, None))[1] is future:
+                self._pending.pop(request.id)
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                length = await self._reader.readexactly(TCP_LENGTH_FIELD_SIZE)
+                payload = await self._reader.readexactly(int.from_bytes(length, 'big'))
+                self.last_used = self.loop.time()
+                try:
+                    response = Response(payload, lazy=True)
+                    response.question
+                except MalformedDNSResponseException:
+                    continue
+                request, future = self._pending.get(response.header.id, (None, None))
+                if future is not None and not future.done() and check_response(request, response):
+                    future.set_result(response)
+        except (asyncio.IncompleteReadError, OSError) as e:
+            self.close(ConnectionError('Connection closed by server') if isinstance(e, asyncio.IncompleteReadError)
+                       else e)
+
+    def close(self, error: Optional[Exception] = None) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        for _, future in self._pending.values():
+            if not future.done():
+                future.set_exception(error or ConnectionError('Connection closed'))
+        self._pending.clear()
+        if self._read_task is not asyncio.current_task(self.loop):
+            self._read_task.cancel()
+        self._writer.close()
+
+
+class AsyncResolver(BaseResolver):
+    client: AsyncDNSClient
+
+    async def resolve(self) -> Response:
+        self.tries = 0
+        if self.client.upstreams is not None:
+            return await self.forward()
+        return await self.retrieve(self.hostname, self.qtype, self.qclass)
+
+    async def forward(self) -> Response:
+        question = Question(self.hostname, self.qtype, self.qclass)
+        tried = []
+        while True:
+            address = self.pick_upstream(tried)
+            try:
+                with self.client.upstreams.outstanding(address):
+                    # Malformed records have to count against this upstream, not surface later from the cache.
+                    response = (await self.retrieve_from(address, question)).materialize()
+            except (HostRetrievalException, MalformedDNSResponseException, DNSError) as e:
+                self.upstream_failed(address, e)
+                continue
+            self.client.upstreams.record_success(address)
+            return response
+
+    async def retrieve(self, hostname: str, qtype: QTYPE, qclass: QCLASS,
+                       previous_answers: List[RR] = None) -> Response:
+        if not previous_answers:
+            previous_answers = []
+        question = Question(hostname, qtype, qclass)
+        known_authorities_name = self.get_greatest_authority_name(DomainName(hostname))
+        authorities = self.get_authorities(known_authorities_name)
+
+        while True:
+            self.remaining(0)
+            address, authorities = await self.get_next_authority(authorities, known_authorities_name)
+            if not address:
+                continue
+            alternates, authorities = self.take_alternates(authorities)
+            try:
+                response = await self.retrieve_from(address, question, alternates)
+                answer, alias, new_authorities = self.handle_response(response, hostname, qtype, qclass,
+                                                                      previous_answers)
+            except (HostRetrievalException, MalformedDNSResponseException):
+                continue
+            except DNSError as e:
+                if e.code is RCODE.NAME_ERROR:
+                    raise DNSNameError(hostname, e.response)
+                continue
+
+            if answer is not None:
+                return answer
+            if alias is not None:
+                return await self.retrieve(alias, qtype, qclass, previous_answers + response.answer)
+            if response.authority:
+                self.client.prefetch_glue(new_authorities)
+                authorities = itertools.chain(new_authorities, authorities)
+
+    async def retrieve_from(self, address: str, question: Question, alternates: List[str] = ()) \
+            -> Optional[Response]:
+        return await self.client.async_query_flights.do((address, question),
+                                                        lambda: self._retrieve_from(address, question, alternates),
+                                                        self.time_left())
+
+    async def _retrieve_from(self, address: str, question: Question, alternates: List[str] = ()) \
+            -> Optional[Response]:
+        request = self.make_query(address, question)
+        host_tries = 0
+
+        resp = None
+        last_exc = None
+        if len(request) <= MAX_UDP_PAYLOAD_SIZE:
+            while resp is None and check_tries(self.tries, host_tries, last_exc, self.max_host_tries):
+                try:
+                    addresses = [address, *alternates]
+                    resp, address = await self.client.query_udp(addresses, request,
+                                                                self.timeout_for(addresses, host_tries))
+                    if self.edns_rejected(request, resp, address):
+                        request, resp = self.make_query(address, question), None
+                except (ConnectionError, TimeoutError, MalformedDNSResponseException) as e:
+                    self.tries += 1
+                    host_tries += 1
+                    last_exc = e
+
+        if resp and resp.header.tc or len(request) > MAX_UDP_PAYLOAD_SIZE:
+            resp = await self.retrieve_via_tcp(request, address, host_tries, question)
+        resp.validate()
+        return resp
+
+    async def retrieve_via_tcp(self, request: Query, address: str, host_tries: int, question: Question) -> Response:
+        last_exc = None
+        while check_tries(self.tries, host_tries, last_exc, self.max_host_tries):
+            try:
+                resp = await self.client.query_tcp(address, request, self.remaining(MAX_RECEIVING_WAIT_TIME_SECONDS))
+                if self.edns_rejected(request, resp, address):
+                    request = self.make_query(address, question)
+                    continue
+                return resp
+            except (OSError, MalformedDNSResponseException) as e:
+                last_exc = e
+            self.tries += 1
+            host_tries += 1
+
+    async def get_next_authority(self, authorities: Iterator[Authority], known_name: DomainName) \
+            -> Tuple[Optional[str], Iterator[Authority]]:
+        authority, authorities = self.next_authority(authorities, known_name)
+        if authority is None:
+            return None, authorities
+
+        if authority.address is None:
+            authority.address = self.client.known_address(authority)
+        if authority.address is None:
+            task = self.client.glue_future(authority)
+            try:
+                authority.address = await asyncio.wait_for(asyncio.shield(task),
+                                                           self.remaining(GLUE_PREFETCH_TIMEOUT_SECONDS))
+            except asyncio.TimeoutError:
+                pass
+            if authority.address is None:
+                self.apply_authority_address(authority, None)
+        return authority.address, authorities
@@ -1,37 +1,103 @@
-import contextlib
 import itertools
-import select
 import socket
-from typing import Dict, List, Optional, Tuple, Iterator
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait, \
+    TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Tuple, Iterator, Iterable, Union
 
-from config import MAX_SENDING_WAIT_TIME_SECONDS, MAX_RECEIVING_WAIT_TIME_SECONDS, ROOT_SERVERS, \
-    PREFERRED_ROOT_SERVER, ROOT_SERVER_NAME_SUFFIX
+from cache import AnswerCache
+from config import BULK_CONCURRENCY, HEDGE_MAX_PARALLEL, MAX_SENDING_WAIT_TIME_SECONDS, \
+    MAX_RECEIVING_WAIT_TIME_SECONDS, MAX_RETRIES_PER_HOST, ROOT_SERVERS, PREFERRED_ROOT_SERVER, ROOT_SERVER_NAME_SUFFIX, \
+    EDNS_UDP_PAYLOAD_SIZE, GLUE_PREFETCH_CONCURRENCY, GLUE_PREFETCH_TIMEOUT_SECONDS, \
+    UPSTREAM_HEALTH_CHECK_TIMEOUT_SECONDS, CACHE_REFRESH_CONCURRENCY, CACHE_REFRESH_TIMEOUT_SECONDS, \
+    CACHE_FAILURE_RECHECK_SECONDS, CACHE_MAX_ENTRIES, STALE_CLIENT_TIMEOUT_SECONDS
 from models import QTYPE, QCLASS, DomainName, RCODE
-from models.constants import PROTOCOL, ADDRESS_FAMILY, PORT, HEADER_ID_SECTION_LENGTH_BITS, TCP_PROTOCOL, \
-    TCP_LENGTH_FIELD_SIZE, MAX_UDP_PAYLOAD_SIZE
+from models.constants import MAX_UDP_PAYLOAD_SIZE, UDP_RECEIVE_BUFFER_SIZE, ADDRESS_FAMILY
 from models.exceptions import MalformedDNSResponseException, NoRespondingServersException, \
-    HostRetrievalException, DNSError, DNSNameError
+    HostRetrievalException, DNSError, DNSNameError, DeadlineExceededException, RetrievalException
 from models.question import Question
-from models.rrs import RR, NS, A, CNAME, DNAME, SOA
-from request.request import Request, Query
+from models.rrs import RR, NS, A, AAAA, CNAME, DNAME, SOA
+from request.request import Query
 from response.response import Response
-from utils import check_tries, check_response, Authority
+from server_stats import ServerStatsTable
+from snapshot import save_snapshot, load_snapshot
+from transport import UDPTransport, TCPConnectionPool, random_id
+from upstream import UpstreamPool, UpstreamPolicy
+from utils import check_tries, Authority, AuthorityTable, SingleFlight
+
+
+BulkQuery = Union[Tuple[str], Tuple[str, QTYPE], Tuple[str, QTYPE, QCLASS]]
+
+# Nameserver addresses are only useful in the family the transports use.
+GLUE_QTYPE = QTYPE.A if ADDRESS_FAMILY == socket.AF_INET else QTYPE.AAAA
+GLUE_RR = A if ADDRESS_FAMILY == socket.AF_INET else AAAA
+RESOLUTION_ERRORS = (RetrievalException, HostRetrievalException, NoRespondingServersException, DNSError, OSError)
+GLUE_ERRORS = (*RESOLUTION_ERRORS, DNSNameError)
+
+
+class Resolution:
+    question: Question
+    response: Optional[Response]
+    error: Optional[Exception]
+
+    def __init__(self, question: Question, response: Optional[Response] = None, error: Optional[Exception] = None):
+        self.question = question
+        self.response = response
+        self.error = error
+
+    @property
+    def successful(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return f"Resolution({self.question}, {self.error if self.error is not None else 'OK'})"
 
 
 class DNSClient:
-    sock: socket.socket
     rd: bool
     required_aa: bool
-    seq: int = 0
-    authorities: Dict[DomainName, Tuple[Dict[DomainName, Authority], Dict[DomainName, Authority]]]
+    hedge_delay: Optional[float]
+    edns_payload_size: Optional[int]
+    authorities: AuthorityTable
+    cache: AnswerCache
+    transport: UDPTransport
+    tcp_pool: TCPConnectionPool
+    server_stats: ServerStatsTable
+    flights: SingleFlight
+    query_flights: SingleFlight
+    upstreams: Optional[UpstreamPool]
+    _glue: Dict[DomainName, Future]
+    _refreshing: Dict[Question, Future]
+    _refresh_failures: OrderedDict[Question, float]
 
-    def __init__(self, rd: bool = True, required_aa: bool = False):
+    def __init__(self, rd: bool = True, required_aa: bool = False, cache: Optional[AnswerCache] = None,
+                 hedge_delay: Optional[float] = None, edns_payload_size: Optional[int] = EDNS_UDP_PAYLOAD_SIZE,
+                 upstreams: Optional[List[str]] = None, upstream_policy: UpstreamPolicy = UpstreamPolicy.LOWEST_SRTT):
+        """With `upstreams` given the client forwards recursive queries to those resolvers instead of iterating
+        from the root servers."""
         self.rd = rd
-        self.sock = socket.socket(ADDRESS_FAMILY, PROTOCOL)
-        self.sock.settimeout(0.1)
-        self.sock.setblocking(False)
+        self.hedge_delay = hedge_delay
+        self.edns_payload_size = edns_payload_size
+        self.cache = cache if cache is not None else AnswerCache()
+        self.flights = SingleFlight()
+        self.query_flights = SingleFlight()
+        self.server_stats = ServerStatsTable()
+        self.transport = UDPTransport(stats=self.server_stats,
+                                      receive_size=max(UDP_RECEIVE_BUFFER_SIZE, edns_payload_size or 0))
+        self.tcp_pool = TCPConnectionPool()
+        self.upstreams = UpstreamPool(upstreams, upstream_policy, self.server_stats, self.probe_upstream) \
+            if upstreams else None
+        self._glue = {}
+        self._glue_executor = None
+        self._glue_lock = threading.Lock()
+        self._refreshing = {}
+        self._refresh_failures = OrderedDict()
+        self._refresh_executor = None
+        self._refresh_lock = threading.Lock()
         self.tries = {}
-        self.authorities = {}
+        self.authorities = AuthorityTable()
         self.required_aa = required_aa
         roots = {
             DomainName(PREFERRED_ROOT_SERVER + ROOT_SERVER_NAME_SUFFIX): Authority(
@@ -46,11 +112,191 @@ class DNSClient:
         self.authorities[DomainName('')] = (roots, {})
 
     def __del__(self):
-        self.sock.close()
+        self.close()
+
+    def close(self):
+        self.transport.close()
+        self.tcp_pool.close()
+        if self.upstreams is not None:
+            self.upstreams.close()
+        if self._glue_executor is not None:
+            self._glue_executor.shutdown(wait=False, cancel_futures=True)
+        if self._refresh_executor is not None:
+            self._refresh_executor.shutdown(wait=False, cancel_futures=True)
+
+    def retrieve(self, name: str, qtype: QTYPE = QTYPE.A, qclass: QCLASS = QCLASS.IN,
+                 deadline: Optional[float] = None) -> Response:
+        question = Question(name, qtype, qclass)
+        cached = self.lookup_cache(question)
+        if cached is not None:
+            return cached
+        stale = self.lookup_stale(question)
+        if stale is None:
+            return self.flights.do(question, lambda: self._resolve(question, deadline), deadline)
+        if self.serve_stale_now(question):
+            return self.check_name_error(question, stale)
+        # With stale data at hand, wait for fresh data only briefly and let the refresh finish in the background.
+        try:
+            return self.refresh(question).result(STALE_CLIENT_TIMEOUT_SECONDS)
+        except (FutureTimeoutError, *RESOLUTION_ERRORS):
+            return self.check_name_error(question, stale)
+
+    def _resolve(self, question: Question, deadline: Optional[float]) -> Response:
+        res = Resolver(self, question.qname.name, question.qtype, question.qclass, deadline)
+        try:
+            response = res.resolve()
+        except DNSNameError as e:
+            self.store_name_error(question, e)
+            raise
+        self.cache.put(question, response)
+        return response
+
+    def retrieve_many(self, queries: Iterable[BulkQuery], concurrency: int = BULK_CONCURRENCY,
+                      deadline: Optional[float] = None) -> Iterator[Resolution]:
+        with ThreadPoolExecutor(concurrency) as executor:
+            pending = set()
+            try:
+                for query in queries:
+                    if len(pending) >= concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        yield from (future.result() for future in done)
+                    pending.add(executor.submit(self._retrieve_item, deadline, *query))
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from (future.result() for future in done)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _retrieve_item(self, deadline: Optional[float], name: str, qtype: QTYPE = QTYPE.A,
+                       qclass: QCLASS = QCLASS.IN) -> Resolution:
+        question = Question(name, qtype, qclass)
+        try:
+            return Resolution(question, self.retrieve(name, qtype, qclass, deadline))
+        except Exception as e:
+            return Resolution(question, error=e)
+
+    def probe_upstream(self, address: str) -> bool:
+        """Health check of an upstream resolver: whether it answers a query for the root NS set."""
+        request = Query(self.next_id(), True, [Question('', QTYPE.NS, QCLASS.IN)])
+        try:
+            self.transport.query(address, request, UPSTREAM_HEALTH_CHECK_TIMEOUT_SECONDS).validate()
+        except (OSError, MalformedDNSResponseException, DNSError):
+            return False
+        return True
+
+    def known_address(self, authority: Authority) -> Optional[str]:
+        """Address of the nameserver of `authority` if the delegation table already has one."""
+        known, _ = self.authorities.get(authority.name) or ({}, {})
+        stored = known.get(authority.nsdname)
+        return authority.address or (stored.address if stored is not None else None)
+
+    def prefetch_glue(self, authorities: Iterable[Authority]) -> None:
+        """Starts resolving, in parallel and in the background, the addresses of the nameservers in `authorities`
+        that came without glue. Resolved addresses are moved into the known half of the delegation table."""
+        for authority in authorities:
+            if self.known_address(authority) is None:
+                self.glue_future(authority)
+
+    def glue_future(self, authority: Authority) -> Future:
+        with self._glue_lock:
+            future = self._glue.get(authority.nsdname)
+            if future is None:
+                if self._glue_executor is None:
+                    self._glue_executor = ThreadPoolExecutor(GLUE_PREFETCH_CONCURRENCY, thread_name_prefix='glue')
+                future = self._glue[authority.nsdname] = self._glue_executor.submit(self.resolve_glue, authority)
+                future.add_done_callback(lambda _: self._glue.pop(authority.nsdname, None))
+            return future
+
+    def resolve_glue(self, authority: Authority, timeout: float = GLUE_PREFETCH_TIMEOUT_SECONDS) -> Optional[str]:
+        response = self.retrieve(authority.nsdname.name, GLUE_QTYPE, QCLASS.IN, timeout)
+        return self.store_glue(authority, response)
+
+    def store_glue(self, authority: Authority, response: Response) -> Optional[str]:
+        for rr in response.answer:
+            if isinstance(rr, GLUE_RR):
+                resolved = Authority(authority.name, authority.nsdname, rr.address)
+                resolved.expiration = authority.expiration
+                self.authorities.add(resolved)
+                return rr.address
+        return None
+
+    def save_snapshot(self, path: str) -> None:
+        """Saves the answer cache and the delegation table to `path`, see snapshot.py."""
+        save_snapshot(path, self.cache, self.authorities)
 
-    def retrieve(self, name: str, qtype: QTYPE = QTYPE.A, qclass: QCLASS = QCLASS.IN) -> Response:
-        res = Resolver(self, name, qtype, qclass)
-        return res.resolve()
+    def load_snapshot(self, path: str) -> Tuple[int, int]:
+        """Restores the unexpired cache entries and authorities saved by save_snapshot."""
+        return load_snapshot(path, self.cache, self.authorities)
+
+    def lookup_cache(self, question: Question) -> Optional[Response]:
+        """Fresh cached response to `question`; a hit close to expiry also starts refreshing the entry."""
+        self.authorities.maybe_sweep()
+        cached = self.cache.get(question)
+        if cached is None:
+            # RFC 8020: nothing exists below a name the cache holds an NXDOMAIN for.
+            cached = self.cache.get_name_error(question)
+        elif self.cache.prefetch_due(question):
+            self.refresh(question)
+        return self.check_name_error(question, cached)
+
+    def lookup_stale(self, question: Question) -> Optional[Response]:
+        return self.cache.get_stale(question)
+
+    @staticmethod
+    def check_name_error(question: Question, response: Optional[Response]) -> Optional[Response]:
+        if response is not None and response.header.rcode is RCODE.NAME_ERROR:
+            raise DNSNameError(question.qname.name, response)
+        return response
+
+    def serve_stale_now(self, question: Question) -> bool:
+        """Whether stale data is answered without waiting for fresh data: while a refresh of `question` is running
+        and for CACHE_FAILURE_RECHECK_SECONDS after one failed (RFC 8767 4)."""
+        if question in self._refreshing:
+            return True
+        with self._refresh_lock:
+            failed_at = self._refresh_failures.get(question)
+            if failed_at is not None and time.monotonic() - failed_at >= CACHE_FAILURE_RECHECK_SECONDS:
+                self._refresh_failures.pop(question)
+                failed_at = None
+        return failed_at is not None
+
+    def record_refresh(self, question: Question, error: Optional[BaseException]) -> None:
+        with self._refresh_lock:
+            # A name that no longer exists is a successful refresh: its NXDOMAIN replaces the stale entry.
+            if error is None or isinstance(error, DNSNameError):
+                self._refresh_failures.pop(question, None)
+                return
+            self._refresh_failures[question] = time.monotonic()
+            self._refresh_failures.move_to_end(question)
+            if len(self._refresh_failures) > CACHE_MAX_ENTRIES:
+                self._refresh_failures.popitem(last=False)
+
+    def refresh(self, question: Question) -> Future:
+        """Resolves `question` again in the background, updating the cache; one refresh per question at a time,
+        bounded by CACHE_REFRESH_TIMEOUT_SECONDS."""
+        with self._refresh_lock:
+            future = self._refreshing.get(question)
+            if future is None:
+                if self._refresh_executor is None:
+                    self._refresh_executor = ThreadPoolExecutor(CACHE_REFRESH_CONCURRENCY, thread_name_prefix='refresh')
+                future = self._refreshing[question] = self._refresh_executor.submit(
+                    self.flights.do, question, lambda: self._resolve(question, CACHE_REFRESH_TIMEOUT_SECONDS),
+                    CACHE_REFRESH_TIMEOUT_SECONDS)
+
+                def done(f: Future):
+                    self._refreshing.pop(question, None)
+                    if not f.cancelled():
+                        self.record_refresh(question, f.exception())
+                future.add_done_callback(done)
+            return future
+
+    def store_name_error(self, question: Question, error: DNSNameError):
+        if error.response is not None:
+            self.cache.put(question, error.response)
+
+    def next_id(self) -> int:
+        return random_id()
 
     def update_authorities(self, authority: List[RR], additional: List[RR]):
         if not authority:
@@ -65,11 +311,11 @@ class DNSClient:
                 authority = Authority.from_soa(rr)
                 new_authorities[authority.nsdname] = authority
         for rr in additional:
-            if isinstance(rr, A) and rr.name in new_authorities:
+            if isinstance(rr, GLUE_RR) and rr.name in new_authorities:
                 new_authorities[rr.name].address = rr.address
 
         for name, auth in new_authorities.items():
-            known, unknown = self.authorities.setdefault(auth.name, ({}, {}))
+            known, unknown = self.authorities.setdefault(auth.name)
             if name in unknown and auth.address is not None:
                 unknown.pop(name)
                 known[name] = auth
@@ -81,33 +327,174 @@ class DNSClient:
         return new_authorities
 
 
-class Resolver:
+class BaseResolver:
     client: DNSClient
     tries: int
-    sock: socket.socket
+    max_host_tries: int
     hostname: str
     qtype: QTYPE
     qclass: QCLASS
     address_stack: List[Authority]
+    deadline: Optional[float]
 
-    def __init__(self, client: DNSClient, hostname: str, qtype: QTYPE = QTYPE.A, qclass: QCLASS = QCLASS.IN):
+    def __init__(self, client: DNSClient, hostname: str, qtype: QTYPE = QTYPE.A, qclass: QCLASS = QCLASS.IN,
+                 deadline: Optional[float] = None):
         self.client = client
         self.tries = 0
+        # A forwarder fails over to the next upstream at once and comes back to it in the next round.
+        self.max_host_tries = MAX_RETRIES_PER_HOST if client.upstreams is None else 0
         self.hostname = hostname
         self.qtype = qtype
         self.qclass = qclass
-        self.sock = socket.socket(ADDRESS_FAMILY, PROTOCOL)
-        self.sock.settimeout(0.1)
-        self.sock.setblocking(False)
         self.address_stack = []
+        self.deadline = time.monotonic() + deadline if deadline is not None else None
 
-    def __del__(self):
-        self.sock.close()
+    def remaining(self, timeout: float) -> float:
+        if self.deadline is None:
+            return timeout
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceededException()
+        return min(timeout, remaining)
+
+    def time_left(self) -> Optional[float]:
+        """Seconds until the deadline, None without one."""
+        return self.remaining(self.deadline - time.monotonic()) if self.deadline is not None else None
+
+    def timeout_for(self, addresses: List[str], attempt: int) -> float:
+        return self.remaining(max(self.client.server_stats.rto(address, attempt) for address in addresses))
+
+    def make_query(self, address: str, question: Question) -> Query:
+        """Builds the query for `address`, advertising the client's EDNS(0) payload size unless the server has
+        rejected EDNS before."""
+        payload_size = self.client.edns_payload_size if self.client.server_stats.edns(address) else None
+        rd = self.client.rd or self.client.upstreams is not None
+        return Query(self.client.next_id(), rd, [question], payload_size)
+
+    def edns_rejected(self, request: Query, response: Response, address: str) -> bool:
+        """Servers without EDNS(0) support answer FORMERR without an OPT record (RFC 6891 7); such a query has to be
+        repeated without OPT."""
+        if request.payload_size is None or response.header.rcode is not RCODE.FORMAT_ERROR or response.opt is not None:
+            return False
+        self.client.server_stats.record_edns_failure(address)
+        return True
+
+    def pick_upstream(self, tried: List[str]) -> str:
+        """Next upstream to forward to; every upstream is tried once per round, for at most
+        MAX_RETRIES_PER_HOST + 1 rounds."""
+        self.remaining(0)
+        upstreams = self.client.upstreams
+        if len(tried) >= len(upstreams) * (MAX_RETRIES_PER_HOST + 1):
+            raise NoRespondingServersException()
+        address = upstreams.pick(tried[len(tried) - len(tried) % len(upstreams):])
+        tried.append(address)
+        return address
+
+    def upstream_failed(self, address: str, error: Exception) -> None:
+        """Accounts for `error` returned by the upstream at `address`; a name error is the final answer and is
+        raised."""
+        if isinstance(error, DNSError) and error.code is RCODE.NAME_ERROR:
+            self.client.upstreams.record_success(address)
+            raise DNSNameError(self.hostname, error.response)
+        self.client.upstreams.record_failure(address)
+
+    def handle_response(self, response: Response, hostname: str, qtype: QTYPE, qclass: QCLASS,
+                        previous_answers: List[RR]) -> Tuple[Optional[Response], Optional[str], List[Authority]]:
+        new_authorities = self.client.update_authorities(response.authority, response.additional).values()
+        new_authorities = sorted(new_authorities, key=lambda x: x.address is None)
+        if response.answer and (response.header.aa or not self.client.required_aa):
+            if qtype == QTYPE.ANY:
+                return response, None, new_authorities
+            if self.check_for_answer(response, hostname, qtype, qclass):
+                response.add_previous_answer(previous_answers)
+                return response, None, new_authorities
+            alias = self.find_alias(response, hostname)
+            if alias is not None:
+                if self.check_for_answer(response, alias, qtype, qclass):
+                    response.add_previous_answer(previous_answers)
+                    return response, None, new_authorities
+                return None, alias, new_authorities
+        if response.header.aa:
+            response.add_previous_answer(previous_answers)
+            return response, None, new_authorities
+        return None, None, new_authorities
+
+    def get_authorities(self, name: DomainName) -> Iterator[Authority]:
+        known, unknown = self.client.authorities.get(name) or ({}, {})
+        return itertools.chain(self.client.server_stats.order(known.values()), list(unknown.values()))
+
+    def next_authority(self, authorities: Iterator[Authority], known_name: DomainName) \
+            -> Tuple[Optional[Authority], Iterator[Authority]]:
+        try:
+            return next(authorities), authorities
+        except StopIteration:
+            if known_name == DomainName(''):
+                raise NoRespondingServersException()
+            known_authorities_name = self.get_greatest_authority_name(known_name.parent())
+            return None, self.get_authorities(known_authorities_name)
 
+    def take_alternates(self, authorities: Iterator[Authority]) -> Tuple[List[str], Iterator[Authority]]:
+        if self.client.hedge_delay is None:
+            return [], authorities
+        alternates = []
+        rest = []
+        for authority in authorities:
+            if authority.address is not None and len(alternates) < HEDGE_MAX_PARALLEL - 1:
+                alternates.append(authority.address)
+            else:
+                rest.append(authority)
+        return alternates, iter(rest)
+
+    def apply_authority_address(self, authority: Authority, response: Optional[Response]) -> None:
+        for rr in response.answer if response is not None else []:
+            if isinstance(rr, GLUE_RR):
+                authority.address = rr.address
+                return
+        self.client.authorities.setdefault(authority.name)[1].pop(authority.nsdname, None)
+
+    def get_greatest_authority_name(self, name: DomainName) -> DomainName:
+        return self.client.authorities.greatest_zone(name)
+
+    @staticmethod
+    def check_for_answer(response: Response, hostname: str, qtype: QTYPE, qclass: QCLASS) -> bool:
+        for rr in response.answer:
+            if rr.name.name == hostname and rr.type_ == qtype and rr.class_ == qclass:
+                return True
+        return False
+
+    @staticmethod
+    def find_alias(response: Response, hostname: str) -> Optional[str]:
+        for rr in response.answer:
+            if rr.name.name == hostname and isinstance(rr, CNAME):
+                return rr.cname.name
+            elif rr.name.name == hostname and isinstance(rr, DNAME):
+                return hostname.replace(rr.name.name, rr.dname.name)
+        return None
+
+
+class Resolver(BaseResolver):
     def resolve(self) -> Response:
         self.tries = 0
+        if self.client.upstreams is not None:
+            return self.forward()
         return self.retrieve(self.hostname, self.qtype, self.qclass)
 
+    def forward(self) -> Response:
+        """Sends the question to the client's upstream resolvers, moving on to the next one on failure."""
+        question = Question(self.hostname, self.qtype, self.qclass)
+        tried = []
+        while True:
+            address = self.pick_upstream(tried)
+            try:
+                with self.client.upstreams.outstanding(address):
+                    # Malformed records have to count against this upstream, not surface later from the cache.
+                    response = self.retrieve_from(address, question).materialize()
+            except (HostRetrievalException, MalformedDNSResponseException, DNSError) as e:
+                self.upstream_failed(address, e)
+                continue
+            self.client.upstreams.record_success(address)
+            return response
+
     def retrieve(self, hostname: str, qtype: QTYPE, qclass: QCLASS, previous_answers: List[RR] = None) -> Response:
         if not previous_answers:
             previous_answers = []
@@ -116,165 +503,95 @@ class Resolver:
         authorities = self.get_authorities(known_authorities_name)
 
         while True:
+            self.remaining(0)
             address, authorities = self.get_next_authority(authorities, known_authorities_name)
             if not address:
                 continue
+            alternates, authorities = self.take_alternates(authorities)
             try:
-                response = self.retrieve_from(address, question)
-            except HostRetrievalException:
+                response = self.retrieve_from(address, question, alternates)
+                answer, alias, new_authorities = self.handle_response(response, hostname, qtype, qclass,
+                                                                      previous_answers)
+            except (HostRetrievalException, MalformedDNSResponseException):
                 continue
             except DNSError as e:
                 if e.code is RCODE.NAME_ERROR:
-                    raise DNSNameError(hostname)
+                    raise DNSNameError(hostname, e.response)
                 continue
 
-            new_authorities = self.client.update_authorities(response.authority, response.additional).values()
-            new_authorities = sorted(new_authorities, key=lambda x: x.address is not None)
-            if response.answer and (response.header.aa or not self.client.required_aa):
-                if qtype == QTYPE.ANY:
-                    return response
-                if self.check_for_answer(response, hostname, qtype, qclass):
-                    response.add_previous_answer(previous_answers)
-                    return response
-                resp = self.check_for_name_alias(response, hostname, qtype, qclass, previous_answers)
-                if resp:
-                    return resp
-            if response.header.aa:
-                response.add_previous_answer(previous_answers)
-                return response
+            if answer is not None:
+                return answer
+            if alias is not None:
+                return self.retrieve(alias, qtype, qclass, previous_answers + response.answer)
             if response.authority:
+                self.client.prefetch_glue(new_authorities)
                 authorities = itertools.chain(new_authorities, authorities)
 
-    def retrieve_from(self, address: str, question: Question) -> Optional[Response]:
-        request = Query(self.client.seq, self.client.rd, [question])
-        self.client.seq += 1
-        self.client.seq %= 2 << HEADER_ID_SECTION_LENGTH_BITS
+    def retrieve_from(self, address: str, question: Question, alternates: List[str] = ()) -> Optional[Response]:
+        return self.client.query_flights.do((address, question),
+                                            lambda: self._retrieve_from(address, question, alternates),
+                                            self.time_left())
+
+    def _retrieve_from(self, address: str, question: Question, alternates: List[str] = ()) -> Optional[Response]:
+        request = self.make_query(address, question)
         host_tries = 0
 
         resp = None
         last_exc = None
         if len(request) <= MAX_UDP_PAYLOAD_SIZE:
-            while resp is None and check_tries(self.tries, host_tries, last_exc):
+            while resp is None and check_tries(self.tries, host_tries, last_exc, self.max_host_tries):
                 try:
-                    self.send(address, request)
-                    resp = self._receive(request)
+                    addresses = [address, *alternates]
+                    resp, address = self.client.transport.query_any(addresses, request,
+                                                                    self.timeout_for(addresses, host_tries),
+                                                                    self.client.hedge_delay)
+                    if self.edns_rejected(request, resp, address):
+                        request, resp = self.make_query(address, question), None
                 except (ConnectionError, TimeoutError, MalformedDNSResponseException) as e:
                     self.tries += 1
                     host_tries += 1
                     last_exc = e
 
         if resp and resp.header.tc or len(request) > MAX_UDP_PAYLOAD_SIZE:
-            resp, _ = self.retrieve_via_tcp(request, address, host_tries)
+            resp, _ = self.retrieve_via_tcp(request, address, host_tries, question)
         resp.validate()
         return resp
 
-    def _receive(self, request: Request) -> Response:
-        if select.select([self.sock], [], [], MAX_RECEIVING_WAIT_TIME_SECONDS)[0]:
-            response, _ = self.sock.recvfrom(2048)
-            if response:
-                resp = Response(response)
-                if check_response(request, resp):
-                    return resp
-                else:
-                    raise MalformedDNSResponseException('Wrong response')
-            else:
-                raise ConnectionError('No response')
-        else:
-            raise TimeoutError()
-
-    def retrieve_via_tcp(self, request: Request, address: str, host_tries: int) -> Tuple[Optional[Response], int]:
+    def retrieve_via_tcp(self, request: Query, address: str, host_tries: int, question: Question) \
+            -> Tuple[Optional[Response], int]:
         last_exc = None
-        while check_tries(self.tries, host_tries, last_exc):
-            sock = socket.socket(ADDRESS_FAMILY, TCP_PROTOCOL)
+        while check_tries(self.tries, host_tries, last_exc, self.max_host_tries):
             try:
-                sock.connect((address, PORT))
-                if select.select([], [sock], [], MAX_SENDING_WAIT_TIME_SECONDS)[1]:
-                    req = bytes(request)
-                    sock.sendall(len(req).to_bytes(TCP_LENGTH_FIELD_SIZE, 'big') + req)
-                    sock.shutdown(socket.SHUT_WR)
-                    request.mark_sent()
-                    buf = b'initial'
-                    resp = b''
-                    while buf and (len(resp) < 2 or len(resp) != int.from_bytes(resp[:2], 'big') + 2) \
-                            and select.select([sock], [], [], MAX_RECEIVING_WAIT_TIME_SECONDS)[0]:
-                        buf = sock.recv(2048)
-                        resp += buf
-                    if resp:
-                        resp = Response(resp[TCP_LENGTH_FIELD_SIZE:])
-                        return resp, host_tries
-                    else:
-                        raise ConnectionError('No response')
-                else:
-                    raise TimeoutError()
-            except (socket.error, MalformedDNSResponseException, ConnectionError, TimeoutError) as e:
+                resp = self.client.tcp_pool.query(address, request, self.remaining(MAX_RECEIVING_WAIT_TIME_SECONDS),
+                                                  self.remaining(MAX_SENDING_WAIT_TIME_SECONDS))
+                if self.edns_rejected(request, resp, address):
+                    request = self.make_query(address, question)
+                    continue
+                return resp, host_tries
+            except (OSError, MalformedDNSResponseException) as e:
                 last_exc = e
-            finally:
-                with contextlib.suppress(Exception):
-                    sock.shutdown(socket.SHUT_RDWR)
-                sock.close()
             self.tries += 1
             host_tries += 1
 
-    def send(self, address: str, request: Request):
-        if select.select([], [self.sock], [], MAX_SENDING_WAIT_TIME_SECONDS)[1]:
-            size = self.sock.sendto(bytes(request), (address, PORT))
-            request.mark_sent()
-            if not size:
-                raise ConnectionError('Cannot send request')
-        else:
-            raise TimeoutError()
-
-    def get_authorities(self, name: DomainName) -> Iterator[Authority]:
-        return itertools.chain(*(d.values() for d in self.client.authorities[name]))
-
     def get_next_authority(self, authorities: Iterator[Authority], known_name) \
             -> Tuple[Optional[str], Iterator[Authority]]:
-        try:
-            authority = next(authorities)
-        except StopIteration:
-            if known_name == DomainName(''):
-                return None, authorities
-            known_authorities_name = self.get_greatest_authority_name(known_name.parent())
-            authorities = self.get_authorities(known_authorities_name)
+        authority, authorities = self.next_authority(authorities, known_name)
+        if authority is None:
             return None, authorities
 
         if authority.address is None:
+            authority.address = self.client.known_address(authority)
+        if authority.address is None:
+            future = self.client.glue_future(authority)
+            timeout = self.remaining(GLUE_PREFETCH_TIMEOUT_SECONDS)
             try:
-                authority_response = self.retrieve(authority.nsdname.name, QTYPE.A, QCLASS.IN)
-                for rr in authority_response.answer:
-                    if isinstance(rr, A):
-                        authority.address = rr.address
-                        break
+                if future.cancel():
+                    # Not started yet: resolve it here rather than wait for a free prefetch worker.
+                    authority.address = self.client.resolve_glue(authority, timeout)
                 else:
-                    self.client.authorities[authority.name][1].pop(authority.nsdname)
-            except DNSNameError:
-                self.client.authorities[authority.name][1].pop(authority.nsdname)
+                    authority.address = future.result(timeout)
+            except (FutureTimeoutError, *GLUE_ERRORS):
+                pass
+            if authority.address is None:
+                self.apply_authority_address(authority, None)
         return authority.address, authorities
-
-    def get_greatest_authority_name(self, name: DomainName) -> DomainName:
-        while name not in self.client.authorities or not self.client.authorities[name][0]:
-            name = name.parent()
-        return name
-
-    @staticmethod
-    def check_for_answer(response: Response, hostname: str, qtype: QTYPE, qclass: QCLASS) -> bool:
-        for rr in response.answer:
-            if rr.name.name == hostname and rr.type_ == qtype and rr.class_ == qclass:
-                return True
-        return False
-
-    def check_for_name_alias(self, response: Response, hostname: str, qtype: QTYPE, qclass: QCLASS,
-                             previous_answers: List[RR]) -> Optional[Response]:
-        for rr in response.answer:
-            if rr.name.name == hostname and isinstance(rr, CNAME):
-                if self.check_for_answer(response, rr.cname.name, qtype, qclass):
-                    response.add_previous_answer(previous_answers)
-                    return response
-                return self.retrieve(rr.cname.name, qtype, qclass, previous_answers + response.answer)
-            elif rr.name.name == hostname and isinstance(rr, DNAME):
-                new_hostname = hostname.replace(rr.name.name, rr.dname.name)
-                if self.check_for_answer(response, new_hostname, qtype, qclass):
-                    response.add_previous_answer(previous_answers)
-                    return response
-                return self.retrieve(new_hostname, qtype, qclass, previous_answers + response.answer)
-        return None
@@ -0,0 +1,47 @@
+"""Query encoding throughput: a fresh Query per message against the cached query templates.
+
+Run from the repository root: python -m benchmarks.encode_benchmark
+"""
+import itertools
+import timeit
+
+from models import QTYPE, QCLASS
+from models.question import Question
+from request.request import Query, Request
+from request.template import QueryEncoder
+
+NAMES = [f'host{i}.example.com' for i in range(100)]
+NUMBER = 20000
+
+
+def measure(fn, number: int = NUMBER) -> float:
+    return number / min(timeit.repeat(fn, number=number, repeat=5))
+
+
+def main():
+    questions = [[Question(name, QTYPE.A, QCLASS.IN)] for name in NAMES]
+    ids = itertools.cycle(range(1 << 16))
+    names = itertools.cycle(questions)
+
+    def query_path():
+        query = Query(next(ids), True, next(names))
+        len(query)
+        return Request.__bytes__(query)
+
+    def query():
+        query = Query(next(ids), True, next(names))
+        len(query)
+        return bytes(query)
+
+    encoder = QueryEncoder()
+
+    def template():
+        return encoder.encode(next(ids), next(names))
+
+    print(f'Query, generic encoding: {measure(query_path):.0f} queries/s')
+    print(f'Query, cached template:  {measure(query):.0f} queries/s')
+    print(f'QueryEncoder:            {measure(template):.0f} queries/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Memory held by an AnswerCache filled with parsed responses.
+
+Each response answers hostN.zoneK.com with a CNAME to lb.zoneK.com and the A record of lb.zoneK.com, so the cache
+holds two records per entry and many repeated target names.
+
+Memory is measured as the growth of the peak resident set size, so the script needs a Unix-like system.
+
+Run from the repository root: python -m benchmarks.memory_benchmark [records]
+"""
+import gc
+import resource
+import socket
+import struct
+import sys
+import time
+
+from cache import AnswerCache
+from response import Response
+
+RECORDS = 1_000_000
+ZONES = 1000
+
+
+def encode_name(name: str) -> bytes:
+    return b''.join(bytes([len(label)]) + label.encode('ascii') for label in name.split('.') if label) + b'\x00'
+
+
+def build_response(i: int) -> bytes:
+    zone = f'zone{i % ZONES}.com'
+    question = encode_name(f'host{i}.{zone}') + struct.pack('>HH', 1, 1)
+    target = encode_name(f'lb.{zone}')
+    cname = b'\xc0\x0c' + struct.pack('>HHIH', 5, 1, 300, len(target)) + target
+    a = b'\xc0' + bytes([12 + len(question) + 12]) + struct.pack('>HHIH', 1, 1, 300, 4) + \
+        socket.inet_aton(f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}')
+    header = struct.pack('>HHHHHH', i % 65536, 0x8180, 1, 2, 0, 0)
+    return header + question + cname + a
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else RECORDS
+    cache = AnswerCache(max_entries=records, max_bytes=2 ** 62)
+    gc.collect()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for i in range(records // 2):
+        response = Response(build_response(i))
+        cache.put(response.question[0], response)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024
+    print(f'{len(cache)} responses, {records} records: {current / 2 ** 20:.1f} MiB, '
+          f'{current / records:.0f} bytes/record, filled in {elapsed:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Parse throughput of Response on a large, AXFR sized message.
+
+Run from the repository root: python -m benchmarks.parse_benchmark
+"""
+import socket
+import struct
+import timeit
+
+from response import Response
+
+ZONE = 'example.com'
+MESSAGE_SIZE = 64 * 1024
+
+
+def encode_name(name: str) -> bytes:
+    return b''.join(bytes([len(label)]) + label.encode('ascii') for label in name.split('.') if label) + b'\x00'
+
+
+def pointer(offset: int) -> bytes:
+    return struct.pack('>H', 0xc000 | offset)
+
+
+def encode_rr(owner: bytes, type_: int, ttl: int, rdata: bytes) -> bytes:
+    return owner + struct.pack('>HHIH', type_, 1, ttl, len(rdata)) + rdata
+
+
+def build_message(size: int = MESSAGE_SIZE) -> bytes:
+    header_length = 12
+    question = encode_name(ZONE) + struct.pack('>HH', 252, 1)
+    zone = pointer(header_length)
+    records = []
+    length = header_length + len(question)
+    i = 0
+    while True:
+        host = bytes([len(f'host{i}')]) + f'host{i}'.encode('ascii') + zone
+        kind = i % 4
+        if kind == 0:
+            record = encode_rr(host, 1, 3600, socket.inet_aton(f'10.0.{i // 256 % 256}.{i % 256}'))
+        elif kind == 1:
+            record = encode_rr(host, 15, 3600, struct.pack('>H', 10) + b'\x04mail' + zone)
+        elif kind == 2:
+            record = encode_rr(zone, 2, 86400, b'\x03ns' + bytes([48 + i % 10]) + zone)
+        else:
+            text = f'v=spf1 include:_spf{i}.{ZONE} ~all'.encode('ascii')
+            record = encode_rr(host, 16, 300, bytes([len(text)]) + text)
+        if length + len(record) > size:
+            break
+        records.append(record)
+        length += len(record)
+        i += 1
+    header = struct.pack('>HHHHHH', 1, 0x8400, 1, len(records), 0, 0)
+    return header + question + b''.join(records)
+
+
+def measure(fn, number: int = 20) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def main():
+    payload = build_message()
+    response = Response(payload)
+    seconds = measure(lambda: Response(payload))
+    print(f'message size: {len(payload)} bytes, records: {len(response.answer)}')
+    print(f'parse time: {seconds * 1000:.2f} ms/message, {len(payload) / seconds / 2 ** 20:.2f} MiB/s, '
+          f'{len(response.answer) / seconds:.0f} records/s')
+
+    header = measure(lambda: Response(payload, lazy=True).header.rcode)
+    index = measure(lambda: Response(payload, lazy=True).answer)
+    first = measure(lambda: Response(payload, lazy=True).answer[0])
+    print(f'lazy: header only {header * 1000:.3f} ms, sections indexed {index * 1000:.2f} ms, '
+          f'first answer {first * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
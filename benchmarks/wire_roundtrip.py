@@ -0,0 +1,61 @@
+"""Decodes and re-encodes one record of every RR class, checking that the wire form survives the round trip.
+
+Run from the repository root: python -m benchmarks.wire_roundtrip
+"""
+import sys
+
+from models import CLASS, DomainName
+from models.rrs import RR, A, NS, CNAME, MX, TXT, AAAA, DNAME, SOA, CAA, PTR, OPT, type_to_RR, get_rr_type
+
+NAME = DomainName('www.example.com')
+TARGET = DomainName('target.example.net')
+TTL = 3600
+
+RECORDS = [
+    RR(NAME, 65280, CLASS.IN, TTL, 4, b'\x01\x02\x03\x04'),
+    A(NAME, TTL, '192.0.2.1'),
+    NS(NAME, CLASS.IN, TTL, -1, TARGET),
+    CNAME(NAME, CLASS.IN, TTL, -1, TARGET),
+    MX(NAME, CLASS.IN, TTL, -1, 10, TARGET),
+    TXT(NAME, CLASS.IN, TTL, -1, 'v=spf1 -all'),
+    AAAA(NAME, CLASS.IN, TTL, -1, '2001:db8::1'),
+    DNAME(NAME, CLASS.IN, TTL, -1, TARGET),
+    SOA(NAME, CLASS.IN, TTL, -1, TARGET, DomainName('hostmaster.example.com'), 2024010101, 7200, 900, 1209600, 300),
+    CAA(NAME, CLASS.IN, TTL, -1, 0, 'issue', 'ca.example.net'),
+    PTR(NAME, CLASS.IN, TTL, -1, TARGET),
+    OPT(1232, flags=1 << 15),
+]
+
+
+def roundtrip(rr: RR) -> bytes:
+    encoded = bytes(rr)
+    name, offset = DomainName.from_bytes(encoded)
+    cls = get_rr_type(encoded, offset)
+    if cls is not type(rr):
+        raise AssertionError(f'decoded as {cls.__name__}')
+    decoded = cls.from_bytes(name, encoded, offset)
+    if decoded.type_ != rr.type_:
+        raise AssertionError(f'type {decoded.type_} instead of {rr.type_}')
+    if bytes(decoded) != encoded:
+        raise AssertionError(f'{bytes(decoded)!r} instead of {encoded!r}')
+    return encoded
+
+
+def main():
+    missing = set(type_to_RR.values()) - {type(rr) for rr in RECORDS}
+    failed = [cls.__name__ for cls in missing]
+    for rr in RECORDS:
+        try:
+            roundtrip(rr)
+        except Exception as e:
+            failed.append(type(rr).__name__)
+            print(f'{type(rr).__name__}: {e}')
+        else:
+            print(f'{type(rr).__name__}: ok')
+    if missing:
+        print(f'No sample record for: {", ".join(sorted(cls.__name__ for cls in missing))}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+from config import CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, NEGATIVE_CACHE_MAX_TTL, SHARED_CACHE_SLOTS, \
+    SHARED_CACHE_SLOT_SIZE, CACHE_PREFETCH_THRESHOLD, CACHE_SERVE_STALE_SECONDS, CACHE_STALE_ANSWER_TTL
+from models import RCODE, DomainName, QCLASS
+from models.exceptions import MalformedDNSResponseException
+from models.question import Question
+from models.rrs import SOA, CNAME, DNAME
+from response import Response
+
+SHARED_SLOT_FORMAT = '>IIddH'
+SHARED_SLOT_HEADER_SIZE = struct.calcsize(SHARED_SLOT_FORMAT)
+
+
+class CacheEntry:
+    __slots__ = ('response', 'stored', 'expiration', 'size')
+    response: Response
+    stored: datetime
+    expiration: datetime
+    size: int
+
+    def __init__(self, response: Response, ttl: int):
+        self.response = response
+        self.stored = datetime.now()
+        self.expiration = self.stored + timedelta(seconds=ttl)
+        self.size = len(response)
+
+    @classmethod
+    def restore(cls, response: Response, stored: datetime, expiration: datetime) -> CacheEntry:
+        entry = cls.__new__(cls)
+        entry.response = response
+        entry.stored = stored
+        entry.expiration = expiration
+        entry.size = len(response)
+        return entry
+
+    @property
+    def expired(self) -> bool:
+        return datetime.now() >= self.expiration
+
+    def age(self) -> int:
+        return int((datetime.now() - self.stored).total_seconds())
+
+    def prefetch_due(self, threshold: float) -> bool:
+        """Whether less than the `threshold` fraction of the entry's TTL is left."""
+        return self.expiration - datetime.now() <= (self.expiration - self.stored) * threshold
+
+
+class AnswerCache:
+    """TTL-aware LRU cache of final responses keyed by question.
+
+    Negative answers (NXDOMAIN and NODATA) are cached as well, for the SOA derived TTL described in RFC 2308.
+    Expired entries are kept for `stale_window` seconds more, to be served when they cannot be refreshed (RFC 8767);
+    `get` never returns them, `get_stale` does. Hits within the last `prefetch_threshold` fraction of an entry's TTL
+    are reported by `prefetch_due`, so that the entry can be refreshed before it expires.
+
+    A cached NXDOMAIN also denies every name below the name it was returned for (RFC 8020), see `get_name_error`.
+    """
+    max_entries: int
+    max_bytes: int
+    stale_window: timedelta
+    prefetch_threshold: float
+    _entries: OrderedDict[Question, CacheEntry]
+    _name_errors: Dict[Tuple[DomainName, QCLASS], Question]
+    _size: int
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES,
+                 stale_window: float = CACHE_SERVE_STALE_SECONDS, prefetch_threshold: float = CACHE_PREFETCH_THRESHOLD):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_window = timedelta(seconds=stale_window)
+        self.prefetch_threshold = prefetch_threshold
+        self._entries = OrderedDict()
+        self._name_errors = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def denied_name(response: Response) -> Optional[DomainName]:
+        """Name an NXDOMAIN response denies: the end of the CNAME chain starting at the question, or None when the
+        chain cannot be followed."""
+        name = response.question[0].qname if response.question else None
+        for rr in response.answer:
+            if isinstance(rr, DNAME):
+                return None
+            if isinstance(rr, CNAME) and rr.name == name:
+                name = rr.cname
+        return name
+
+    @staticmethod
+    def negative_ttl(response: Response) -> Optional[int]:
+        for rr in response.authority:
+            if isinstance(rr, SOA):
+                return min(rr.ttl, rr.minimum, NEGATIVE_CACHE_MAX_TTL)
+        return None
+
+    @classmethod
+    def ttl_of(cls, response: Response) -> Optional[int]:
+        if response.header.rcode is RCODE.NAME_ERROR or not response.answer:
+            return cls.negative_ttl(response)
+        return min(rr.ttl for rr in response.answer)
+
+    def get(self, question: Question) -> Optional[Response]:
+        with self._lock:
+            entry = self._entries.get(question)
+            if entry is None:
+                return None
+            if entry.expired:
+                self._drop_if_past_stale(question, entry)
+                return None
+            self._entries.move_to_end(question)
+        return entry.response.aged(entry.age())
+
+    def get_name_error(self, question: Question) -> Optional[Response]:
+        """Cached NXDOMAIN for the query name or one of its ancestors, which proves the name does not exist."""
+        with self._lock:
+            name = question.qname
+            while name.labels:
+                denied = self._name_errors.get((name, question.qclass))
+                entry = self._entries.get(denied) if denied is not None else None
+                if entry is not None and not entry.expired:
+                    self._entries.move_to_end(denied)
+                    break
+                name = name.parent()
+            else:
+                return None
+        return entry.response.aged(entry.age())
+
+    def get_stale(self, question: Question) -> Optional[Response]:
+        """The expired entry for `question` while it is within the stale window, with its TTLs set to
+        CACHE_STALE_ANSWER_TTL as RFC 8767 recommends."""
+        with self._lock:
+            entry = self._entries.get(question)
+            if entry is None or not entry.expired or self._drop_if_past_stale(question, entry):
+                return None
+        return entry.response.aged(entry.age(), CACHE_STALE_ANSWER_TTL)
+
+    def prefetch_due(self, question: Question) -> bool:
+        with self._lock:
+            entry = self._entries.get(question)
+        return entry is not None and not entry.expired and entry.prefetch_due(self.prefetch_threshold)
+
+    def put(self, question: Question, response: Response) -> None:
+        # A lazy response would hold on to the received message next to every record decoded from it.
+        response.materialize()
+        ttl = self.ttl_of(response)
+        if not ttl:
+            return
+        entry = CacheEntry(response, ttl)
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            self._insert(question, entry)
+
+    def restore(self, question: Question, entry: CacheEntry) -> None:
+        """Inserts an entry built elsewhere, e.g. loaded from a snapshot, keeping its original expiration."""
+        if entry.expired or entry.size > self.max_bytes:
+            return
+        with self._lock:
+            self._insert(question, entry)
+
+    def entries(self) -> List[Tuple[Question, CacheEntry]]:
+        """Unexpired entries, least recently used first."""
+        with self._lock:
+            return [(question, entry) for question, entry in self._entries.items() if not entry.expired]
+
+    def _drop_if_past_stale(self, question: Question, entry: CacheEntry) -> bool:
+        if datetime.now() < entry.expiration + self.stale_window:
+            return False
+        self._remove(question)
+        return True
+
+    def _insert(self, question: Question, entry: CacheEntry) -> None:
+        if question in self._entries:
+            self._remove(question)
+        self._entries[question] = entry
+        self._size += entry.size
+        if entry.response.header.rcode is RCODE.NAME_ERROR:
+            name = self.denied_name(entry.response)
+            if name is not None and name.labels:
+                self._name_errors[name, question.qclass] = question
+        self._evict()
+
+    def _remove(self, question: Question) -> None:
+        entry = self._entries.pop(question)
+        self._size -= entry.size
+        if entry.response.header.rcode is RCODE.NAME_ERROR:
+            key = self.denied_name(entry.response), question.qclass
+            if self._name_errors.get(key) == question:
+                del self._name_errors[key]
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._name_errors.clear()
+            self._size = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, question: Question):
+        return question in self._entries
+
+
+class SharedAnswerCache:
+    """Answer cache in a shared memory block, readable by every process attached to it.
+
+    The block is a direct-mapped table of fixed-size slots holding encoded responses, split into one region per
+    shard. A question is stored only in the region of its shard. Writes are serialized by a lock of the attached
+    process, so a slot is never written by two threads at once; it is safe only as long as each shard is written by
+    a single process, as ShardedResolver arranges. Each slot carries a sequence number that the writer makes odd
+    while it updates the slot, and readers, which take no lock, discard a slot whose sequence number is odd or
+    changed while they copied it. A new entry overwrites whatever was stored in its slot, and responses longer than
+    a slot are not stored.
+    """
+    shards: int
+    slots: int
+    slot_size: int
+    _memory: shared_memory.SharedMemory
+
+    def __init__(self, shards: int, slots: int = SHARED_CACHE_SLOTS, slot_size: int = SHARED_CACHE_SLOT_SIZE,
+                 name: Optional[str] = None):
+        """Creates the block, or attaches to the existing block `name` created with the same parameters."""
+        self.shards = shards
+        self.slots = slots - slots % shards
+        self.slot_size = slot_size
+        if name is None:
+            self._memory = shared_memory.SharedMemory(create=True, size=self.slots * slot_size)
+        else:
+            self._memory = shared_memory.SharedMemory(name)
+        self._buffer = self._memory.buf
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    def shard_of(self, qname: DomainName) -> int:
+        return zlib.crc32(qname.name.lower().encode('latin-1')) % self.shards
+
+    @staticmethod
+    def _key(question: Question) -> int:
+        return zlib.crc32(bytes(question))
+
+    def _slot(self, question: Question, key: int) -> int:
+        per_shard = self.slots // self.shards
+        return (self.shard_of(question.qname) * per_shard + key % per_shard) * self.slot_size
+
+    def get(self, question: Question) -> Optional[Response]:
+        key = self._key(question)
+        offset = self._slot(question, key)
+        seq, stored_key, stored, expiration, length = struct.unpack_from(SHARED_SLOT_FORMAT, self._buffer, offset)
+        now = time.time()
+        if seq % 2 or stored_key != key or now >= expiration or length > self.slot_size - SHARED_SLOT_HEADER_SIZE:
+            return None
+        start = offset + SHARED_SLOT_HEADER_SIZE
+        payload = bytes(self._buffer[start:start + length])
+        if struct.unpack_from(SHARED_SLOT_FORMAT, self._buffer, offset)[0] != seq:
+            return None
+        try:
+            response = Response(payload)
+        except MalformedDNSResponseException:
+            return None
+        if list(response.question) != [question]:
+            return None
+        return response.aged(int(now - stored))
+
+    def put(self, question: Question, response: Response) -> None:
+        """Stores `response` for the SOA or answer derived TTL, see AnswerCache.ttl_of."""
+        ttl = AnswerCache.ttl_of(response)
+        if not ttl:
+            return
+        payload = bytes(response)
+        if len(payload) > self.slot_size - SHARED_SLOT_HEADER_SIZE:
+            return
+        key = self._key(question)
+        offset = self._slot(question, key)
+        with self._lock:
+            seq = struct.unpack_from(SHARED_SLOT_FORMAT, self._buffer, offset)[0]
+            struct.pack_into('>I', self._buffer, offset, (seq + 1) & 0xffffffff | 1)
+            now = time.time()
+            start = offset + SHARED_SLOT_HEADER_SIZE
+            self._buffer[start:start + len(payload)] = payload
+            struct.pack_into(SHARED_SLOT_FORMAT, self._buffer, offset, (seq + 2) & 0xfffffffe, key, now, now + ttl,
+                             len(payload))
+
+    def close(self) -> None:
+        self._buffer = None
+        self._memory.close()
+
+    def unlink(self) -> None:
+        self._memory.unlink()
@@ -3,6 +3,33 @@ MAX_RECEIVING_WAIT_TIME_SECONDS = 20
 MAX_RETRIES_PER_HOST = 3
 MAX_RETRIES = 20
 
+BULK_CONCURRENCY = 64
+UDP_SOCKET_POOL_SIZE = 4
+UDP_SOCKET_MAX_QUERIES = 64
+TCP_POOL_SIZE = 64
+TCP_IDLE_TIMEOUT_SECONDS = 10
+
+HEDGE_MAX_PARALLEL = 3
+
+QUERY_TEMPLATE_CACHE_SIZE = 4096
+
+EDNS_UDP_PAYLOAD_SIZE = 1232
+
+GLUE_PREFETCH_CONCURRENCY = 8
+GLUE_PREFETCH_TIMEOUT_SECONDS = 5
+
+UPSTREAM_MAX_FAILURES = 3
+UPSTREAM_EJECT_SECONDS = 30
+UPSTREAM_HEALTH_CHECK_INTERVAL_SECONDS = 5
+UPSTREAM_HEALTH_CHECK_TIMEOUT_SECONDS = 2
+
+SERVE_ADDRESS = '127.0.0.1'
+SERVE_PORT = 53
+SERVE_RESOLUTION_TIMEOUT_SECONDS = 10
+SERVE_MAX_PENDING_QUERIES = 10000
+SERVE_TCP_IDLE_TIMEOUT_SECONDS = 10
+SERVE_UDP_RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+
 ROOT_SERVERS = {
     "a": "198.41.0.4",
     "b": "192.228.79.201",
@@ -21,3 +48,30 @@ ROOT_SERVERS = {
 
 PREFERRED_ROOT_SERVER = 'f'
 ROOT_SERVER_NAME_SUFFIX = '.root-servers.net'
+
+CACHE_MAX_ENTRIES = 10000
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+NEGATIVE_CACHE_MAX_TTL = 3 * 60 * 60
+CACHE_PREFETCH_THRESHOLD = 0.1
+CACHE_SERVE_STALE_SECONDS = 24 * 60 * 60
+CACHE_STALE_ANSWER_TTL = 30
+CACHE_REFRESH_CONCURRENCY = 16
+CACHE_REFRESH_TIMEOUT_SECONDS = 10
+CACHE_FAILURE_RECHECK_SECONDS = 30
+STALE_CLIENT_TIMEOUT_SECONDS = 1.8
+
+SHARED_CACHE_SLOTS = 1 << 15
+SHARED_CACHE_SLOT_SIZE = 1024
+SHARDED_WORKERS = None
+
+MAX_AUTHORITY_ZONES = 5000
+AUTHORITY_SWEEP_INTERVAL_SECONDS = 60
+
+UNKNOWN_SERVER_SRTT_SECONDS = 0.0
+SERVER_FAILURE_PENALTY_SECONDS = 2.0
+SERVER_PENALTY_HALF_LIFE_SECONDS = 600
+MAX_SERVER_STATS = 10000
+
+INITIAL_RTO_SECONDS = 1.0
+MIN_RTO_SECONDS = 0.2
+MAX_RTO_SECONDS = MAX_RECEIVING_WAIT_TIME_SECONDS
@@ -1,4 +1,5 @@
 HEADER_LENGTH = 12
+HEADER_FORMAT = '>HHHHHH'
 
 HEADER_ID_SECTION = slice(0, 2)
 HEADER_ID_SECTION_LENGTH_BITS = 16
@@ -7,3 +7,5 @@ PORT = 53
 
 TCP_LENGTH_FIELD_SIZE = 2
 MAX_UDP_PAYLOAD_SIZE = 512
+UDP_RECEIVE_BUFFER_SIZE = 2048
+TCP_RECEIVE_BUFFER_SIZE = 65536
@@ -1,2 +1,3 @@
 POINTER_MASK = 0b11000000
 POINTER_OFFSET_MASK = 0x3fff
+POINTER_FORMAT = '>H'
@@ -4,16 +4,34 @@ RR_TTL_SECTION = slice(4, 8)
 RR_RDLENGTH_SECTION = slice(8, 10)
 RR_RDATA_SECTION = slice(10, None)
 RR_FIXED_LENGTH = 10
+RR_FIXED_FORMAT = '>HHIH'
+RR_RDLENGTH_OFFSET = RR_RDLENGTH_SECTION.start
+RR_RDLENGTH_FORMAT = '>H'
+
+QUESTION_FIXED_LENGTH = 4
 
 MX_PREFERENCE_SECTION = slice(0, 2)
+MX_PREFERENCE_LENGTH = 2
+MX_PREFERENCE_FORMAT = '>H'
+
+TXT_MAX_STRING_LENGTH = 255
 
 SOA_SERIAL_SECTION_LENGTH = 4
 SOA_REFRESH_SECTION_LENGTH = 4
 SOA_RETRY_SECTION_LENGTH = 4
 SOA_EXPIRE_SECTION_LENGTH = 4
 SOA_MINIMUM_SECTION_LENGTH = 4
+SOA_FIXED_FORMAT = '>IIIII'
+
+OPT_EXTENDED_RCODE_SHIFT = 24
+OPT_VERSION_SHIFT = 16
+OPT_VERSION_MASK = 0xff
+OPT_FLAGS_MASK = 0xffff
+OPT_DO_MASK = 0x8000
 
 CAA_FLAGS_SECTION = slice(0, 1)
 CAA_TAG_LENGTH_SECTION = slice(1, 2)
 CAA_TAG_SECTION = slice(2, None)
+CAA_FLAGS_LENGTH = 1
+CAA_TAG_LENGTH_LENGTH = 1
 
@@ -1,70 +1,123 @@
 from __future__ import annotations
 
-from typing import List, Optional, Tuple
+import sys
+from typing import Dict, Optional, Tuple, Union
 
 from models.constants.response_constants import POINTER_MASK, POINTER_OFFSET_MASK
 
 
+INTERN_TABLE_SIZE = 1 << 16
+
+
 class DomainName:
+    """Domain name stored as its dotted string; the labels are split off on first use and kept, so that names which
+    are only stored, such as record targets, do not carry them."""
+    __slots__ = ('_name', '_labels')
     _name: str
-    _labels: List[str]
+    _labels: Optional[Tuple[str, ...]]
 
     def __init__(self, name: str):
-        self._name = name
-        self._labels = [label for label in name.split('.') if label != '']
+        self._name = sys.intern(name)
+        self._labels = None
 
-        for label in self._labels:
+        for label in name.split('.'):
             if len(label) > 63:
                 raise ValueError("Label length must be less than 63")
 
+    @classmethod
+    def intern(cls, name: str) -> DomainName:
+        """Returns a shared instance for `name`, so that names repeated across messages and cached records are
+        stored once. The table is emptied when it grows past INTERN_TABLE_SIZE."""
+        domain_name = _interned.get(name)
+        if domain_name is None:
+            if len(_interned) >= INTERN_TABLE_SIZE:
+                _interned.clear()
+            domain_name = _interned[name] = cls(name)
+        return domain_name
+
     @property
     def name(self) -> str:
         return self._name
 
     @property
-    def labels(self) -> List[str]:
-        return self._labels
+    def labels(self) -> Tuple[str, ...]:
+        labels = self._labels
+        if labels is None:
+            labels = self._labels = tuple(label for label in self._name.split('.') if label != '')
+        return labels
 
     def cut(self, n: int) -> DomainName:
-        if n > len(self._labels):
+        labels = self.labels
+        if n > len(labels):
             raise ValueError("Cannot cut more labels than there are")
-        return DomainName('.'.join(self._labels[n:]))
+        return DomainName('.'.join(labels[n:]))
 
     def parent(self) -> DomainName:
         return self.cut(1)
 
     def __bytes__(self):
         arr = bytearray()
-        for label in self._labels:
+        for label in self.labels:
             arr.extend(int.to_bytes(len(label), 1, 'big'))
-            arr.extend(label.encode("ascii"))
+            arr.extend(label.encode("latin-1"))
         arr.extend(b'\x00')
 
         return bytes(arr)
 
     @classmethod
-    def from_bytes(cls, payload: bytes, original: Optional[bytes] = None) -> Tuple[DomainName, int]:
+    def from_bytes(cls, payload: Union[bytes, memoryview], offset: int = 0, names: Optional[NameCache] = None) \
+            -> Tuple[DomainName, int]:
+        """Parses the name starting at `offset` of the whole message `payload`.
+
+        Returns the name and the number of bytes it occupies at `offset`; compression pointers are followed within
+        `payload` itself, so it is never sliced. `names` maps message offsets to the names already decoded there;
+        pass the same dict for every name of a message and each suffix is decoded only once. A pointer must point
+        before the labels that led to it, which rules out pointer loops.
+        """
+        if names is None:
+            names = {}
         labels = []
-        length = 0
-        it = iter(payload)
-        for n in it:
-            if n == 0:
-                length += 1
+        starts = []
+        length = None
+        limit = position = offset
+        while True:
+            suffix = names.get(position)
+            if suffix is not None:
                 break
-            elif n & POINTER_MASK:
-                offset = n * (1 << 8) + next(it)
-                offset &= POINTER_OFFSET_MASK
-                if original is None:
-                    raise ValueError("Original payload not provided")
-                dn, _ = DomainName.from_bytes(original[offset:], original)
-                labels.extend(dn.labels)
-                length += 2
+            n = payload[position]
+            if n == 0:
+                suffix = ROOT
                 break
-            else:
-                label = ''.join(chr(next(it)) for _ in range(n))
-                labels.append(label)
-                length += n + 1
-        return cls('.'.join(labels)), length
+            if n & POINTER_MASK:
+                if length is None:
+                    length = position + 2 - offset
+                pointer = (n << 8 | payload[position + 1]) & POINTER_OFFSET_MASK
+                if pointer >= limit:
+                    raise ValueError("Compression pointer does not point backwards")
+                limit = position = pointer
+                continue
+            starts.append(position)
+            labels.append(str(payload[position + 1: position + 1 + n], 'latin-1'))
+            position += n + 1
+        if length is None:
+            length = position - offset + (cls.skip(payload, position) if suffix is not ROOT else 1)
+
+        name = suffix
+        for i in range(len(labels) - 1, -1, -1):
+            name = names[starts[i]] = cls.intern(f'{labels[i]}.{name._name}' if name._name else labels[i])
+        return name, length
+
+    @staticmethod
+    def skip(payload: Union[bytes, memoryview], offset: int = 0) -> int:
+        """Returns the number of bytes the name at `offset` occupies without decoding it."""
+        position = offset
+        while True:
+            n = payload[position]
+            if n == 0:
+                return position + 1 - offset
+            if n & POINTER_MASK:
+                return position + 2 - offset
+            position += n + 1
 
     def __len__(self):
         return (len(self._name) or -1) + 2
@@ -82,3 +135,8 @@ class DomainName:
 
     def __repr__(self):
         return self._name
+
+
+_interned: Dict[str, DomainName] = {}
+ROOT = DomainName('')
+NameCache = Dict[int, DomainName]
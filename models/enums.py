@@ -25,6 +25,7 @@ class TYPE(ByteEnum):
     TXT = 16
     AAAA = 28
     DNAME = 39
+    OPT = 41
     CAA = 257
 
 
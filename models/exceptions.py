@@ -1,5 +1,10 @@
+from typing import Optional, TYPE_CHECKING
+
 from models import RCODE
 
+if TYPE_CHECKING:
+    from response import Response
+
 
 class AlreadySentException(Exception):
     def __init__(self):
@@ -16,6 +21,11 @@ class RetrievalException(Exception):
         super().__init__(message)
 
 
+class DeadlineExceededException(RetrievalException):
+    def __init__(self):
+        super().__init__('resolution deadline exceeded')
+
+
 class HostRetrievalException(Exception):
     def __init__(self, message: str):
         super().__init__(message)
@@ -24,11 +34,13 @@ class HostRetrievalException(Exception):
 class DNSError(Exception):
     code: RCODE
     aa: bool
+    response: Optional['Response']
 
-    def __init__(self, message: str, code: RCODE, aa: bool):
+    def __init__(self, message: str, code: RCODE, aa: bool, response: Optional['Response'] = None):
         super().__init__(message)
         self.code = code
         self.aa = aa
+        self.response = response
 
 
 class NoRespondingServersException(Exception):
@@ -37,5 +49,13 @@ class NoRespondingServersException(Exception):
 
 
 class DNSNameError(Exception):
-    def __init__(self, hostname: str):
+    response: Optional['Response']
+
+    def __init__(self, hostname: str, response: Optional['Response'] = None):
         super().__init__('no such name ' + hostname)
+        self.response = response
+
+
+class InvalidSnapshotException(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
@@ -6,6 +6,8 @@ from models import QR, OPCODE, RCODE
 
 
 class Header:
+    __slots__ = ('_id', '_flags', '_qdcount', '_ancount', '_nscount', '_arcount', '_qr', '_opcode', '_aa', '_tc', '_rd',
+                 '_ra', '_z', '_rcode')
     _id: int
     _flags: int
     _qdcount: int
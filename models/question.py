@@ -3,9 +3,12 @@ from __future__ import annotations
 from typing import Optional, Union
 
 from models import QTYPE, QCLASS, DomainName
+from models.domain_name import NameCache
+from models.wire import WireWriter
 
 
 class Question:
+    __slots__ = ('_qname', '_qtype', '_qclass')
     _qname: DomainName
     _qtype: QTYPE
     _qclass: QCLASS
@@ -49,10 +52,16 @@ class Question:
 
         return bytes(arr)
 
+    def to_wire(self, writer: WireWriter) -> None:
+        writer.write_name(self._qname)
+        writer.write(bytes(self._qtype))
+        writer.write(bytes(self._qclass))
+
     @classmethod
-    def from_bytes(cls, payload: bytes) -> Question:
-        qname, n = DomainName.from_bytes(payload)
-        n = len(qname)
+    def from_bytes(cls, payload: Union[bytes, memoryview], offset: int = 0, names: Optional[NameCache] = None) \
+            -> Question:
+        qname, n = DomainName.from_bytes(payload, offset, names)
+        n += offset
         qtype = QTYPE.from_bytes(payload[n: n+2])
         qclass = QCLASS.from_bytes(payload[n+2: n+4])
 
@@ -1,17 +1,24 @@
 from __future__ import annotations
 
+import copy
 from datetime import timedelta
 import socket
-from typing import Type, Union, Optional
+import struct
+from typing import Tuple, Type, Union, Optional
 
 from models import TYPE, CLASS, DomainName
-from models.constants.rr_constants import RR_TYPE_SECTION, RR_CLASS_SECTION, RR_TTL_SECTION, RR_RDLENGTH_SECTION, \
-    RR_RDATA_SECTION, RR_FIXED_LENGTH, MX_PREFERENCE_SECTION, SOA_SERIAL_SECTION_LENGTH, SOA_REFRESH_SECTION_LENGTH, \
-    SOA_RETRY_SECTION_LENGTH, SOA_EXPIRE_SECTION_LENGTH, SOA_MINIMUM_SECTION_LENGTH, CAA_FLAGS_SECTION, \
-    CAA_TAG_LENGTH_SECTION, CAA_TAG_SECTION
+from models.domain_name import NameCache, ROOT
+from models.constants.rr_constants import RR_TYPE_SECTION, RR_FIXED_FORMAT, RR_FIXED_LENGTH, RR_RDLENGTH_OFFSET, \
+    RR_RDLENGTH_FORMAT, MX_PREFERENCE_FORMAT, MX_PREFERENCE_LENGTH, SOA_FIXED_FORMAT, CAA_FLAGS_LENGTH, \
+    CAA_TAG_LENGTH_LENGTH, TXT_MAX_STRING_LENGTH, OPT_EXTENDED_RCODE_SHIFT, OPT_VERSION_SHIFT, OPT_VERSION_MASK, \
+    OPT_FLAGS_MASK, OPT_DO_MASK
+from models.wire import WireWriter
+
+Payload = Union[bytes, memoryview]
 
 
 class RR:
+    __slots__ = ('_name', '_type', '_class', '_ttl', '_rdlength', '_rdata')
     _name: DomainName
     _type: TYPE
     _class: CLASS
@@ -29,23 +36,48 @@ class RR:
         self._rdata = rdata
 
     def __bytes__(self):
-        ...
+        writer = WireWriter(compress=False)
+        self.to_wire(writer)
+        return bytes(writer)
+
+    def to_wire(self, writer: WireWriter) -> None:
+        """Appends the record to the message being built by `writer`; rdlength is filled in after the rdata."""
+        writer.write_name(self._name)
+        start = len(writer)
+        writer.pack(RR_FIXED_FORMAT, self._type, self._class, self._ttl, 0)
+        self.write_rdata(writer)
+        writer.patch(start + RR_RDLENGTH_OFFSET, RR_RDLENGTH_FORMAT, len(writer) - start - RR_FIXED_LENGTH)
+
+    def write_rdata(self, writer: WireWriter) -> None:
+        writer.write(self._rdata or b'')
+
+    @staticmethod
+    def parse_fixed(payload: Payload, offset: int) -> Tuple[int, int, int, int, int]:
+        """Reads the fixed part of the RR at `offset` (just after its owner name) without copying the payload.
+
+        Returns type, class, ttl, rdlength and the offset at which rdata starts.
+        """
+        type_, class_, ttl, rdlength = struct.unpack_from(RR_FIXED_FORMAT, payload, offset)
+        return type_, class_, ttl, rdlength, offset + RR_FIXED_LENGTH
 
     @classmethod
-    def from_bytes(cls, name: DomainName, payload: bytes, original: bytes) -> RR:
+    def from_bytes(cls, name: DomainName, payload: Payload, offset: int, names: Optional[NameCache] = None) -> RR:
+        type_, class_, ttl, rdlength, start = cls.parse_fixed(payload, offset)
         try:
-            type_ = TYPE.from_bytes(payload[RR_TYPE_SECTION])
+            type_ = TYPE(type_)
         except ValueError:
-            type_ = int.from_bytes(payload[RR_TYPE_SECTION], 'big')
-        class_ = CLASS.from_bytes(payload[RR_CLASS_SECTION])
-        ttl = int.from_bytes(payload[RR_TTL_SECTION], 'big')
-        rdlength = int.from_bytes(payload[RR_RDLENGTH_SECTION], 'big')
-        rdata = payload[RR_RDATA_SECTION.start: RR_RDATA_SECTION.start + rdlength]
-        return cls(name, type_, class_, ttl, len(rdata), rdata)
+            pass
+        rdata = bytes(payload[start: start + rdlength])
+        return cls(name, type_, CLASS(class_), ttl, len(rdata), rdata)
 
     def __len__(self):
         return len(self._name) + RR_FIXED_LENGTH + self._rdlength
 
+    def aged(self, seconds: int, minimum: int = 0) -> RR:
+        rr = copy.copy(self)
+        rr._ttl = max(self._ttl - seconds, minimum)
+        return rr
+
     def __repr__(self):
         type_name = self._type if not isinstance(self._type, TYPE) else self._type.name
         return f'{self._name} {type_name} {self._class.name} {timedelta(seconds=self._ttl)} {self._rdata}'
@@ -76,24 +108,25 @@ class RR:
 
 
 class A(RR):
-    _type = TYPE.A
-    _class = CLASS.IN
+    __slots__ = ('_address',)
+    rr_type = TYPE.A
     _address: str
 
     def __init__(self, name: DomainName, ttl: int, address: str, rdlength: int = -1):
         if rdlength == -1:
             rdlength = 4
-        super().__init__(name, self.type_, self.class_, ttl, rdlength)
+        super().__init__(name, self.rr_type, CLASS.IN, ttl, rdlength)
         self._address = address
 
     @classmethod
-    def from_bytes(cls, name: DomainName, payload: bytes, original: bytes) -> RR:
-        ttl = int.from_bytes(payload[RR_TTL_SECTION], 'big')
-        rdlength = int.from_bytes(payload[RR_RDLENGTH_SECTION], 'big')
-        rdata = payload[RR_RDATA_SECTION.start: RR_RDATA_SECTION.start + rdlength]
-        address = socket.inet_ntop(socket.AF_INET, rdata)
+    def from_bytes(cls, name: DomainName, payload: Payload, offset: int, names: Optional[NameCache] = None) -> RR:
+        _, _, ttl, rdlength, start = cls.parse_fixed(payload, offset)
+        address = socket.inet_ntop(socket.AF_INET, payload[start: start + rdlength])
         return cls(name, ttl, address, rdlength)
 
+    def write_rdata(self, writer: WireWriter) -> None:
+        writer.write(socket.inet_pton(socket.AF_INET, self._address))
+
     def __repr__(self):
         return f'{self._name} {self.type_.name} {self.class_.name} {timedelta(seconds=self._ttl)} {self._address}'
 
@@ -103,22 +136,24 @@ class A(RR):
 
 
 class NS(RR):
-    _type = TYPE.NS
+    __slots__ = ('_nsdname',)
+    rr_type = TYPE.NS
     _nsdname: DomainName
 
     def __init__(self, name: DomainName, class_: CLASS, ttl: int, rdlength: int, nsdname: DomainName):
-        super().__init__(name, self.type_, class_, ttl, rdlength)
+        super().__init__(name, self.rr_type, class_, ttl, rdlength)
         self._nsdname = nsdname
 
     @classmethod
-    def from_bytes(cls, name: DomainName, payload: bytes, original: bytes) -> RR:
-        class_ = CLASS.from_bytes(payload[RR_CLASS_SECTION])
-        ttl = int.from_bytes(payload[RR_TTL_SECTION], 'big')
-        rdlength = int.from_bytes(payload[RR_RDLENGTH_SECTION], 'big')
-        rdata = payload[RR_RDATA_SECTION.start: RR_RDATA_SECTION.start + rdlength]
-        nsdname, _ = DomainName.from_bytes(rdata, original)
+    def from_bytes(cls, name: DomainName, payload: Payload, offset: int, names: Optional[NameCache] = None) -> RR:
+        _, class_, ttl, rdlength, start = cls.parse_fixed(payload, offset)
+        class_ = CLASS(class_)
+        nsdname, _ = DomainName.from_bytes(payload, start, names)
         return cls(name, class_, ttl, rdlength, nsdname)
 
+    def write_rdata(self, writer: WireWriter) -> None:
+        writer.write_name(self._nsdname)
+
     def __repr__(self):
         return f'{self._name} {self.type_.name} {self._class.name} {timedelta(seconds=self._ttl)} {self._nsdname}'
 
@@ -128,22 +163,24 @@ class NS(RR):
 
 
 class CNAME(RR):
-    _type = TYPE.CNAME
+    __slots__ = ('_cname',)
+    rr_type = TYPE.CNAME
     _cname: DomainName
 
     def __init__(self, name: DomainName, class_: CLASS, ttl: int, rdlength: int, cname: DomainName):
-        super().__init__(name, self.type_, class_, ttl, rdlength)
+        super().__init__(name, self.rr_type, class_, ttl, rdlength)
         self._cname = cname
 
     @classmethod
-    def from_bytes(cls, name: DomainName, payload: bytes, original: bytes) -> RR:
-        class_ = CLASS.from_bytes(payload[RR_CLASS_SECTION])
-        ttl = int.from_bytes(payload[RR_TTL_SECTION], 'big')
-        rdlength = int.from_bytes(payload[RR_RDLENGTH_SECTION], 'big')
-        rdata = payload[RR_RDATA_SECTION.start: RR_RDATA_SECTION.start + rdlength]
-        cname, _ = DomainName.from_bytes(rdata, original)
+    def from_bytes(cls, name: DomainName, payload: Payload, offset: int, names: Optional[NameCache] = None) -> RR:
+        _, class_, ttl, rdlength, start = cls.parse_fixed(payload, offset)
+        class_ = CLASS(class_)
+        cname, _ = DomainName.from_bytes(payload, start, names)
         return cls(name, class_, ttl, rdlength, cname)
 
+    def write_rdata(self, writer: WireWriter) -> None:
+        writer.write_name(self._cname)
+
     def __repr__(self):
         return f'{self._name} {self.type_.name} {self._class.name} {timedelta(self._ttl)} {self._cname}'
 
@@ -153,25 +190,28 @@ class CNAME(RR):
 
 
 class MX(RR):
-    _type = TYPE.MX
+    __slots__ = ('_preference', '_exchange')
+    rr_type = TYPE.MX
     _preference: int
     _exchange: DomainName
 
     def __init__(self, name: DomainName, class_: CLASS, ttl: int, rdlength: int, preference: int, exchange: DomainName):
-        super().__init__(name, self.type_, class_, ttl, rdlength)
+        super().__init__(name, self.rr_type, class_, ttl, rdlength)
         self._preference = preference
         self._exchange = exchange
 
     @classmethod
-    def from_bytes(cls, name: DomainName, payload: bytes, original: bytes) -> RR:
-        class_ = CLASS.from_bytes(payload[RR_CLASS_SECTION])
-        ttl = int.from_bytes(payload[RR_TTL_SECTION], 'big')
-        rdlength = int.from_bytes(payload[RR_RDLENGTH_SECTION], 'big')
-        rdata = payload[RR_RDATA_SECTION.start: RR_RDATA_SECTION.start + rdlength]
-        preference = int.from_bytes(rdata[MX_PREFERENCE_SECTION], 'big')
-        exchange, _ = DomainName.from_bytes(rdata[2:], original)
+    def from_bytes(cls, name: DomainName, payload: Payload, offset: int, names: Optional[NameCache] = None) -> RR:
+        _, class_, ttl, rdlength, start = cls.parse_fixed(payload, offset)
+        class_ = CLASS(class_)
+        preference = int.from_bytes(payload[start: start + MX_PREFERENCE_LENGTH], 'big')
+        exchange, _ = DomainName.from_bytes(payload, start + MX_PREFERENCE_LENGTH, names)
         return cls(name, class_, ttl, rdlength, preference, exchange)
 
+    def write_rdata(self, writer: WireWriter) -> None:
+        writer.pack(MX_PREFERENCE_FORMAT, self._preference)
+        writer.write_name(self._exchange)
+
     def __repr__(self):
         return f'{self._name} {self.type_.name} {self._class.name} {timedelta(seconds=self._ttl)} {self._preference} ' \
                f'{self._exchange}'
@@ -186,26 +226,33 @@ class MX(RR):
 
 
 class TXT(RR):
-    _type = TYPE.TXT
+    __slots__ = ('_txt',)
+    rr_type = TYPE.TXT
     _txt: str
 
     def __init__(self, name: DomainName, class_: CLASS, ttl: int, rdlength: int, txt: str):
-        super().__init__(name, self.type_, class_, ttl, rdlength)
+        super().__init__(name, self.rr_type, class_, ttl, rdlength)
         self._txt = txt
 
     @classmethod
-    def from_bytes(cls, name: DomainName, payload: bytes, original: bytes) -> RR:
-        class_ = CLASS.from_bytes(payload[RR_CLASS_SECTION])
-        ttl = int.from_bytes(payload[RR_TTL_SECTION], 'big')
-        rdlength = int.from_bytes(payload[RR_RDLENGTH_SECTION], 'big')
-        rdata = payload[RR_RDATA_SECTION.start: RR_RDATA_SECTION.start + rdlength]
-        txt = ''
-        while rdata:
-            length = int.from_bytes(rdata[:1], 'big')
-            txt += rdata[1:1 + length].decode('utf-8')
-            rdata = rdata[1 + length:]
+    def from_bytes(cls, name: DomainName, payload: Payload, offset: int, names: Optional[NameCache] = None) -> RR:
+        _, class_, ttl, rdlength, start = cls.parse_fixed(payload, offset)
+        class_ = CLASS(class_)
+        strings = []
+        position, end = start, start + rdlength
+        while position < end:
+            length = payload[position]
+            strings.append(str(payload[position + 1: position + 1 + length], 'utf-8'))
+            position += 1 + length
+        txt = ''.join(strings)
         return cls(name, class_, ttl, rdlength, txt)
 
+    def write_rdata(self, writer: WireWriter) -> None:
+        data = self._txt.encode('utf-8')
+        for i in range(0, len(data), TXT_MAX_STRING_LENGTH):
+            chunk = data[i: i + TXT_MAX_STRING_LENGTH]
+            writer.write(bytes([len(chunk)]) + chunk)
+
     def __repr__(self):
         return f'{self._name} {self.type_.name} {self._class.name} {timedelta(seconds=self._ttl)} {self._txt}'
 
@@ -215,22 +262,24 @@ class TXT(RR):
 
 
 class AAAA(RR):
-    _type = TYPE.AAAA
+    __slots__ = ('_address',)
+    rr_type = TYPE.AAAA
     _address: str
 
     def __init__(self, name: DomainName, class_: CLASS, ttl: int, rdlength: int, address: str):
-        super().__init__(name, self.type_, class_, ttl, rdlength)
+        super().__init__(name, self.rr_type, class_, ttl, rdlength)
         self._address = address
 
     @classmethod
-    def from_bytes(cls, name: DomainName, payload: bytes, original: bytes) -> RR:
-        class_ = CLASS.from_bytes(payload[RR_CLASS_SECTION])
-        ttl = int.from_bytes(payload[RR_TTL_SECTION], 'big')
-        rdlength = int.from_bytes(payload[RR_RDLENGTH_SECTION], 'big')
-        rdata = payload[RR_RDATA_SECTION.start: RR_RDATA_SECTION.start + rdlength]
-        address = socket.inet_ntop(socket.AF_INET6, rdata)
+    def from_bytes(cls, name: DomainName, payload: Payload, offset: int, names: Optional[NameCache] = None) -> RR:
+        _, class_, ttl, rdlength, start = cls.parse_fixed(payload, offset)
+        class_ = CLASS(class_)
+        address = socket.inet_ntop(socket.AF_INET6, payload[start: start + rdlength])
         return cls(name, class_, ttl, rdlength, address)
 
+    def write_rdata(self, writer: WireWriter) -> None:
+        writer.write(socket.inet_pton(socket.AF_INET6, self._address))
+
     def __repr__(self):
         return f'{self._name} {self.type_.name} {self._class.name} {timedelta(seconds=self._ttl)} {self._address}'
 
@@ -240,22 +289,24 @@ class AAAA(RR):
 
 
 class DNAME(RR):
-    _type = TYPE.CNAME
+    __slots__ = ('_dname',)
+    rr_type = TYPE.DNAME
     _dname: DomainName
 
     def __init__(self, name: DomainName, class_: CLASS, ttl: int, rdlength: int, cname: DomainName):
-        super().__init__(name, self.type_, class_, ttl, rdlength)
+        super().__init__(name, self.rr_type, class_, ttl, rdlength)
         self._dname = cname
 
     @classmethod
-    def from_bytes(cls, name: DomainName, payload: bytes, original: bytes) -> RR:
-        class_ = CLASS.from_bytes(payload[RR_CLASS_SECTION])
-        ttl = int.from_bytes(payload[RR_TTL_SECTION], 'big')
-        rdlength = int.from_bytes(payload[RR_RDLENGTH_SECTION], 'big')
-        rdata = payload[RR_RDATA_SECTION.start: RR_RDATA_SECTION.start + rdlength]
-        cname, _ = DomainName.from_bytes(rdata, original)
+    def from_bytes(cls, name: DomainName, payload: Payload, offset: int, names: Optional[NameCache] = None) -> RR:
+        _, class_, ttl, rdlength, start = cls.parse_fixed(payload, offset)
+        class_ = CLASS(class_)
+        cname, _ = DomainName.from_bytes(payload, start, names)
         return cls(name, class_, ttl, rdlength, cname)
 
+    def write_rdata(self, writer: WireWriter) -> None:
+        writer.write_name(self._dname, compress=False)
+
     def __repr__(self):
         return f'{self._name} {self.type_.name} {self._class.name} {timedelta(self._ttl)} {self._dname}'
 
@@ -265,7 +316,8 @@ class DNAME(RR):
 
 
 class SOA(RR):
-    _type = TYPE.SOA
+    __slots__ = ('_mname', '_rname', '_serial', '_refresh', '_retry', '_expire', '_minimum')
+    rr_type = TYPE.SOA
     _mname: DomainName
     _rname: DomainName
     _serial: int
@@ -276,7 +328,7 @@ class SOA(RR):
 
     def __init__(self, name: DomainName, class_: CLASS, ttl: int, rdlength: int, mname: DomainName, rname: DomainName,
                  serial: int, refresh: int, retry: int, expire: int, minimum: int):
-        super().__init__(name, self.type_, class_, ttl, rdlength)
+        super().__init__(name, self.rr_type, class_, ttl, rdlength)
         self._mname = mname
         self._rname = rname
         self._serial = serial
@@ -286,25 +338,20 @@ class SOA(RR):
         self._minimum = minimum
 
     @classmethod
-    def from_bytes(cls, name: DomainName, payload: bytes, original: bytes) -> RR:
-        class_ = CLASS.from_bytes(payload[RR_CLASS_SECTION])
-        ttl = int.from_bytes(payload[RR_TTL_SECTION], 'big')
-        rdlength = int.from_bytes(payload[RR_RDLENGTH_SECTION], 'big')
-        rdata = payload[RR_RDATA_SECTION.start: RR_RDATA_SECTION.start + rdlength]
-        mname, length = DomainName.from_bytes(rdata, original)
-        rname, rname_length = DomainName.from_bytes(rdata[length:], original)
+    def from_bytes(cls, name: DomainName, payload: Payload, offset: int, names: Optional[NameCache] = None) -> RR:
+        _, class_, ttl, rdlength, start = cls.parse_fixed(payload, offset)
+        class_ = CLASS(class_)
+        mname, length = DomainName.from_bytes(payload, start, names)
+        rname, rname_length = DomainName.from_bytes(payload, start + length, names)
         length += rname_length
-        serial = int.from_bytes(rdata[length: length + SOA_SERIAL_SECTION_LENGTH], 'big')
-        length += SOA_SERIAL_SECTION_LENGTH
-        refresh = int.from_bytes(rdata[length: length + SOA_REFRESH_SECTION_LENGTH], 'big')
-        length += SOA_REFRESH_SECTION_LENGTH
-        retry = int.from_bytes(rdata[length: length + SOA_RETRY_SECTION_LENGTH], 'big')
-        length += SOA_RETRY_SECTION_LENGTH
-        expire = int.from_bytes(rdata[length: length + SOA_EXPIRE_SECTION_LENGTH], 'big')
-        length += SOA_EXPIRE_SECTION_LENGTH
-        minimum = int.from_bytes(rdata[length: length + SOA_MINIMUM_SECTION_LENGTH], 'big')
+        serial, refresh, retry, expire, minimum = struct.unpack_from(SOA_FIXED_FORMAT, payload, start + length)
         return cls(name, class_, ttl, rdlength, mname, rname, serial, refresh, retry, expire, minimum)
 
+    def write_rdata(self, writer: WireWriter) -> None:
+        writer.write_name(self._mname)
+        writer.write_name(self._rname)
+        writer.pack(SOA_FIXED_FORMAT, self._serial, self._refresh, self._retry, self._expire, self._minimum)
+
     def __repr__(self):
         rname = self._rname.labels[0].replace('\\', '') + '@' + '.'.join(self._rname.labels[1:])
         return f'{self._name} {self.type_.name} {self._class.name} {timedelta(seconds=self._ttl)} {self._mname} ' \
@@ -341,51 +388,57 @@ class SOA(RR):
 
 
 class CAA(RR):
-    _type = TYPE.CAA
+    __slots__ = ('flags', 'tag', 'value')
+    rr_type = TYPE.CAA
     flags: int
     tag: str
     value: str
 
     def __init__(self, name: DomainName, class_: CLASS, ttl: int, rdlength: int, flags: int, tag: str, value: str):
-        super().__init__(name, self.type_, class_, ttl, rdlength)
+        super().__init__(name, self.rr_type, class_, ttl, rdlength)
         self.flags = flags
         self.tag = tag
         self.value = value
 
     @classmethod
-    def from_bytes(cls, name: DomainName, payload: bytes, original: bytes) -> RR:
-        class_ = CLASS.from_bytes(payload[RR_CLASS_SECTION])
-        ttl = int.from_bytes(payload[RR_TTL_SECTION], 'big')
-        rdlength = int.from_bytes(payload[RR_RDLENGTH_SECTION], 'big')
-        rdata = payload[RR_RDATA_SECTION.start: RR_RDATA_SECTION.start + rdlength]
-        flags = int.from_bytes(rdata[CAA_FLAGS_SECTION], 'big')
-        tag_length = int.from_bytes(rdata[CAA_TAG_LENGTH_SECTION], 'big')
-        tag = rdata[CAA_TAG_SECTION.start: CAA_TAG_SECTION.start + tag_length].decode('utf-8')
-        value = rdata[CAA_TAG_SECTION.start + tag_length:].decode('utf-8')
+    def from_bytes(cls, name: DomainName, payload: Payload, offset: int, names: Optional[NameCache] = None) -> RR:
+        _, class_, ttl, rdlength, start = cls.parse_fixed(payload, offset)
+        class_ = CLASS(class_)
+        flags = payload[start]
+        tag_length = payload[start + CAA_FLAGS_LENGTH]
+        tag_start = start + CAA_FLAGS_LENGTH + CAA_TAG_LENGTH_LENGTH
+        tag = str(payload[tag_start: tag_start + tag_length], 'utf-8')
+        value = str(payload[tag_start + tag_length: start + rdlength], 'utf-8')
         return cls(name, class_, ttl, rdlength, flags, tag, value)
 
+    def write_rdata(self, writer: WireWriter) -> None:
+        tag = self.tag.encode('utf-8')
+        writer.write(bytes([self.flags, len(tag)]) + tag + self.value.encode('utf-8'))
+
     def __repr__(self):
         return f'{self._name} {self.type_.name} {self._class.name} {timedelta(seconds=self._ttl)} ' \
                f'{str(bin(self.flags))[2:]} {self.tag} {self.value}'
 
 
 class PTR(RR):
-    _type = TYPE.PTR
+    __slots__ = ('_ptrdname',)
+    rr_type = TYPE.PTR
     _ptrdname: DomainName
 
     def __init__(self, name: DomainName, class_: CLASS, ttl: int, rdlength: int, ptrdname: DomainName):
-        super().__init__(name, self.type_, class_, ttl, rdlength)
+        super().__init__(name, self.rr_type, class_, ttl, rdlength)
         self._ptrdname = ptrdname
 
     @classmethod
-    def from_bytes(cls, name: DomainName, payload: bytes, original: bytes) -> RR:
-        class_ = CLASS.from_bytes(payload[RR_CLASS_SECTION])
-        ttl = int.from_bytes(payload[RR_TTL_SECTION], 'big')
-        rdlength = int.from_bytes(payload[RR_RDLENGTH_SECTION], 'big')
-        rdata = payload[RR_RDATA_SECTION.start: RR_RDATA_SECTION.start + rdlength]
-        ptrdname, length = DomainName.from_bytes(rdata, original)
+    def from_bytes(cls, name: DomainName, payload: Payload, offset: int, names: Optional[NameCache] = None) -> RR:
+        _, class_, ttl, rdlength, start = cls.parse_fixed(payload, offset)
+        class_ = CLASS(class_)
+        ptrdname, _ = DomainName.from_bytes(payload, start, names)
         return cls(name, class_, ttl, rdlength, ptrdname)
 
+    def write_rdata(self, writer: WireWriter) -> None:
+        writer.write_name(self._ptrdname)
+
     def __repr__(self):
         return f'{self._name} {self.type_.name} {self._class.name} {timedelta(seconds=self._ttl)} {self._ptrdname}'
 
@@ -394,6 +447,51 @@ class PTR(RR):
         return self._ptrdname
 
 
+class OPT(RR):
+    """EDNS(0) pseudo-record (RFC 6891). The class field carries the sender's UDP payload size and the ttl field the
+    extended rcode, the EDNS version and the flags."""
+    __slots__ = ()
+    rr_type = TYPE.OPT
+
+    def __init__(self, payload_size: int, extended_rcode: int = 0, version: int = 0, flags: int = 0,
+                 options: bytes = b''):
+        ttl = extended_rcode << OPT_EXTENDED_RCODE_SHIFT | version << OPT_VERSION_SHIFT | flags
+        super().__init__(ROOT, self.rr_type, payload_size, ttl, len(options), options)
+
+    @classmethod
+    def from_bytes(cls, name: DomainName, payload: Payload, offset: int, names: Optional[NameCache] = None) -> RR:
+        _, payload_size, ttl, rdlength, start = cls.parse_fixed(payload, offset)
+        return cls(payload_size, ttl >> OPT_EXTENDED_RCODE_SHIFT, ttl >> OPT_VERSION_SHIFT & OPT_VERSION_MASK,
+                   ttl & OPT_FLAGS_MASK, bytes(payload[start: start + rdlength]))
+
+    def aged(self, seconds: int, minimum: int = 0) -> RR:
+        return self
+
+    def __repr__(self):
+        return f'{self.type_.name} udp={self.payload_size} version={self.version} do={int(self.dnssec_ok)} ' \
+               f'{self._rdata}'
+
+    @property
+    def payload_size(self) -> int:
+        return self._class
+
+    @property
+    def extended_rcode(self) -> int:
+        return self._ttl >> OPT_EXTENDED_RCODE_SHIFT
+
+    @property
+    def version(self) -> int:
+        return self._ttl >> OPT_VERSION_SHIFT & OPT_VERSION_MASK
+
+    @property
+    def dnssec_ok(self) -> bool:
+        return bool(self._ttl & OPT_DO_MASK)
+
+    @property
+    def options(self) -> bytes:
+        return self._rdata
+
+
 type_to_RR = {
     TYPE.A: A,
     TYPE.NS: NS,
@@ -404,13 +502,14 @@ type_to_RR = {
     TYPE.DNAME: DNAME,
     TYPE.SOA: SOA,
     TYPE.CAA: CAA,
-    TYPE.PTR: PTR
+    TYPE.PTR: PTR,
+    TYPE.OPT: OPT
 }
 
 
-def get_rr_type(payload: bytes) -> Type[RR]:
+def get_rr_type(payload: Payload, offset: int = 0) -> Type[RR]:
     try:
-        type_ = TYPE.from_bytes(payload[RR_TYPE_SECTION])
+        type_ = TYPE.from_bytes(payload[offset + RR_TYPE_SECTION.start: offset + RR_TYPE_SECTION.stop])
     except ValueError:
         return RR
     return type_to_RR.get(type_, RR)
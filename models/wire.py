@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import struct
+from typing import Dict, Tuple
+
+from models.domain_name import DomainName
+from models.constants.response_constants import POINTER_MASK, POINTER_OFFSET_MASK, POINTER_FORMAT
+
+
+class WireWriter:
+    """Builds a DNS message, compressing names against the suffixes already written (RFC 1035 4.1.4).
+
+    Every name written records the offset of each of its suffixes, so a later name sharing a suffix is emitted as
+    its distinct labels followed by a pointer. Suffixes are matched exactly, so names keep their case on the wire.
+    A writer with `compress` unset produces a self-contained fragment, which can be embedded anywhere in a message.
+    """
+    compress: bool
+    _buffer: bytearray
+    _suffixes: Dict[Tuple[str, ...], int]
+
+    def __init__(self, compress: bool = True):
+        self.compress = compress
+        self._buffer = bytearray()
+        self._suffixes = {}
+
+    def write(self, data: bytes) -> None:
+        self._buffer += data
+
+    def pack(self, fmt: str, *values: int) -> None:
+        self._buffer += struct.pack(fmt, *values)
+
+    def patch(self, offset: int, fmt: str, *values: int) -> None:
+        struct.pack_into(fmt, self._buffer, offset, *values)
+
+    def write_name(self, name: DomainName, compress: bool = True) -> None:
+        """Writes `name`; with `compress` unset it is written in full, but its suffixes can still be pointed to."""
+        labels = name.labels
+        key = tuple(labels)
+        for i in range(len(key)):
+            pointer = self._suffixes.get(key[i:]) if compress and self.compress else None
+            if pointer is not None:
+                self.pack(POINTER_FORMAT, POINTER_MASK << 8 | pointer)
+                return
+            if len(self._buffer) <= POINTER_OFFSET_MASK:
+                self._suffixes.setdefault(key[i:], len(self._buffer))
+            label = labels[i].encode('latin-1')
+            self._buffer.append(len(label))
+            self._buffer += label
+        self._buffer.append(0)
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def __bytes__(self):
+        return bytes(self._buffer)
@@ -7,13 +7,15 @@ from models.exceptions import AlreadySentException
 
 
 class RequestHeader(Header):
-    _sent: bool = False
+    __slots__ = ('_sent',)
+    _sent: bool
 
     class Builder:
         def __init__(self):
             self.val_id = 0
             self.val_qdcount = 0
             self.val_ancount = 0
+            self.val_arcount = 0
             self.val_rd = True
             self.val_opcode = OPCODE.QUERY
 
@@ -33,6 +35,12 @@ class RequestHeader(Header):
             self.val_ancount = ancount
             return self
 
+        def arcount(self, arcount: int) -> RequestHeader.Builder:
+            if arcount < 0 or arcount > 65535:
+                raise ValueError('arcount must be between 0 and 65535')
+            self.val_arcount = arcount
+            return self
+
         def rd(self, rd: bool) -> RequestHeader.Builder:
             self.val_rd = rd
             return self
@@ -45,11 +53,12 @@ class RequestHeader(Header):
             return RequestHeader(self)
 
     def __init__(self, builder: Builder):
+        self._sent = False
         self._id = builder.val_id
         self._qdcount = builder.val_qdcount
         self._ancount = builder.val_ancount
         self._nscount = 0
-        self._arcount = 0
+        self._arcount = builder.val_arcount
         self._qr = QR.QUERY
         self._opcode = builder.val_opcode
         self._aa = False
@@ -1,11 +1,12 @@
 from abc import ABC
-from typing import List
+from typing import List, Optional
 
 from models import OPCODE
-from models.constants import HEADER_LENGTH
 from models.exceptions import AlreadySentException
-from models.rrs import RR
+from models.rrs import RR, OPT
+from models.wire import WireWriter
 from .header import RequestHeader
+from .template import query_encoder
 from models.question import Question
 
 
@@ -14,13 +15,15 @@ class Request(ABC):
     _header: RequestHeader
     _question: List[Question]
     _answer: List[RR]
+    _additional: List[RR]
     _sent = False
 
-    def __init__(self, id_, rd, questions: List[Question], answers: List[RR]):
+    def __init__(self, id_, rd, questions: List[Question], answers: List[RR], additionals: List[RR] = ()):
         self._header = RequestHeader.Builder().rd(rd).id(id_).opcode(self._type).\
-            qdcount(len(questions)).ancount(len(answers)).build()
+            qdcount(len(questions)).ancount(len(answers)).arcount(len(additionals)).build()
         self._question = questions
         self._answer = answers
+        self._additional = list(additionals)
 
     @property
     def header(self) -> RequestHeader:
@@ -50,6 +53,10 @@ class Request(ABC):
     def answers(self) -> List[RR]:
         return self._answer
 
+    @property
+    def additionals(self) -> List[RR]:
+        return self._additional
+
     @property
     def sent(self) -> bool:
         return self._sent
@@ -58,26 +65,38 @@ class Request(ABC):
         self._sent = True
 
     def __bytes__(self):
-        arr = bytearray()
-        arr.extend(bytes(self._header))
+        writer = WireWriter()
+        writer.write(bytes(self._header))
 
         for question in self._question:
-            arr.extend(bytes(question))
+            question.to_wire(writer)
 
         for answer in self._answer:
-            arr.extend(bytes(answer))
+            answer.to_wire(writer)
+
+        for additional in self._additional:
+            additional.to_wire(writer)
 
-        return bytes(arr)
+        return bytes(writer)
 
     def __len__(self):
-        return HEADER_LENGTH + sum(len(q) for q in self._question) + sum(len(a) for a in self._answer)
+        """Size of the encoded message, with names compressed."""
+        return len(bytes(self))
 
 
 class Query(Request):
     _type: OPCODE = OPCODE.QUERY
 
-    def __init__(self, id_: int, rd: bool, question: List[Question]):
-        super().__init__(id_, rd, question, [])
+    _payload_size: Optional[int]
+
+    def __init__(self, id_: int, rd: bool, question: List[Question], payload_size: Optional[int] = None):
+        """With `payload_size` set the query carries an OPT record advertising that UDP payload size (EDNS(0))."""
+        super().__init__(id_, rd, question, [], [OPT(payload_size)] if payload_size is not None else [])
+        self._payload_size = payload_size
+
+    @property
+    def payload_size(self) -> Optional[int]:
+        return self._payload_size
 
     @Request.question.setter
     def question(self, question: List[Question]):
@@ -85,3 +104,9 @@ class Query(Request):
             raise AlreadySentException()
         self._question = question
         self._header.qdcount = len(question)
+
+    def __bytes__(self):
+        return query_encoder.encode(self.id, self._question, self.rd, self._payload_size)
+
+    def __len__(self):
+        return len(query_encoder.template(self._question, self.rd, self._payload_size))
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from config import QUERY_TEMPLATE_CACHE_SIZE
+from models.constants import HEADER_ID_SECTION
+from models.question import Question
+from models.rrs import OPT
+from models.wire import WireWriter
+from .header import RequestHeader
+
+TemplateKey = Tuple[Tuple[Question, ...], bool, Optional[int]]
+
+
+class QueryTemplate:
+    """Encoded query for fixed questions, rd flag and EDNS payload size; only the id differs between the messages
+    built from it."""
+    _tail: bytes
+
+    def __init__(self, questions: List[Question], rd: bool = True, payload_size: Optional[int] = None):
+        writer = WireWriter()
+        arcount = 1 if payload_size is not None else 0
+        writer.write(bytes(RequestHeader.Builder().rd(rd).qdcount(len(questions)).arcount(arcount).build()))
+        for question in questions:
+            question.to_wire(writer)
+        if payload_size is not None:
+            OPT(payload_size).to_wire(writer)
+        self._tail = bytes(writer)[HEADER_ID_SECTION.stop:]
+
+    def encode(self, id_: int) -> bytes:
+        return id_.to_bytes(HEADER_ID_SECTION.stop, 'big') + self._tail
+
+    def __len__(self):
+        return HEADER_ID_SECTION.stop + len(self._tail)
+
+
+class QueryEncoder:
+    """LRU cache of query templates keyed by the questions, the rd flag and the EDNS payload size."""
+    max_templates: int
+    _templates: OrderedDict[TemplateKey, QueryTemplate]
+
+    def __init__(self, max_templates: int = QUERY_TEMPLATE_CACHE_SIZE):
+        self.max_templates = max_templates
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def template(self, questions: List[Question], rd: bool = True, payload_size: Optional[int] = None) \
+            -> QueryTemplate:
+        key = tuple(questions), rd, payload_size
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                return template
+        template = QueryTemplate(questions, rd, payload_size)
+        with self._lock:
+            self._templates[key] = template
+            while len(self._templates) > self.max_templates:
+                self._templates.popitem(last=False)
+        return template
+
+    def encode(self, id_: int, questions: List[Question], rd: bool = True, payload_size: Optional[int] = None) \
+            -> bytes:
+        return self.template(questions, rd, payload_size).encode(id_)
+
+    def __len__(self):
+        return len(self._templates)
+
+
+query_encoder = QueryEncoder()
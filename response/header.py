@@ -10,11 +10,13 @@ from models.exceptions import DNSError, MalformedDNSResponseException
 
 
 class ResponseHeader(Header):
+    __slots__ = ('_valid',)
     _valid: bool
 
     def __init__(self, payload: bytes):
         if len(payload) < HEADER_LENGTH:
             raise MalformedDNSResponseException("Invalid header")
+        self._valid = False
         self._id = int.from_bytes(payload[HEADER_ID_SECTION], byteorder='big')
         self._flags = int.from_bytes(payload[HEADER_FLAGS_SECTION], byteorder='big')
         self._qdcount = int.from_bytes(payload[HEADER_QDCOUNT_SECTION], byteorder='big')
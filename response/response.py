@@ -1,105 +1,283 @@
 from __future__ import annotations
 
-from typing import List, Optional
+import copy
+import itertools
+import struct
+from collections.abc import Sequence
+from typing import Any, Callable, List, Optional
 
 from models import DomainName, QR
-from models.constants import HEADER_LENGTH
-from models.constants.rr_constants import RR_FIXED_LENGTH
-from models.exceptions import MalformedDNSResponseException
+from models.domain_name import NameCache
+from models.constants import HEADER_LENGTH, HEADER_FORMAT
+from models.constants.rr_constants import RR_FIXED_LENGTH, RR_RDLENGTH_FORMAT, RR_RDLENGTH_OFFSET, \
+    QUESTION_FIXED_LENGTH
+from models.exceptions import MalformedDNSResponseException, DNSError
 from models.question import Question
-from models.rrs import RR, get_rr_type
+from models.rrs import RR, OPT, get_rr_type
+from models.wire import WireWriter
 from response.header import ResponseHeader
 
 
+class LazySection(Sequence):
+    """Records of one section of a lazily decoded response.
+
+    Holds the offset of every record within the message and decodes a record only the first time it is accessed.
+    """
+    __slots__ = ('_payload', '_offsets', '_parse', '_items')
+    _payload: memoryview
+    _offsets: List[int]
+    _items: list
+
+    def __init__(self, payload: memoryview, offsets: List[int], parse: Callable[[memoryview, int], Any]):
+        self._payload = payload
+        self._offsets = offsets
+        self._parse = parse
+        self._items = [None] * len(offsets)
+
+    def _get(self, i: int):
+        item = self._items[i]
+        if item is None:
+            try:
+                item = self._items[i] = self._parse(self._payload, self._offsets[i])
+            except (ValueError, IndexError, struct.error) as e:
+                raise MalformedDNSResponseException(f"Malformed DNS response") from e
+        return item
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._get(j) for j in range(*i.indices(len(self._offsets)))]
+        if i < 0:
+            i += len(self._offsets)
+        if not 0 <= i < len(self._offsets):
+            raise IndexError(i)
+        return self._get(i)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, LazySection)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 class Response:
+    __slots__ = ('_header', '_question', '_answer', '_authority', '_additional', '_payload')
     _header: ResponseHeader
-    _question: List[Question]
-    _answer: List[RR]
-    _authority: List[RR]
-    _additional: List[RR]
+    _question: Optional[Sequence[Question]]
+    _answer: Optional[Sequence[RR]]
+    _authority: Optional[Sequence[RR]]
+    _additional: Optional[Sequence[RR]]
+    _payload: Optional[memoryview]
 
-    def __init__(self, payload: bytes):
+    def __init__(self, payload: bytes, lazy: bool = False):
+        """Parses `payload`. With `lazy` only the header is decoded here; the section boundaries are indexed on the
+        first access to a section and each record is decoded the first time it is read.
+        """
         try:
-            self._header = ResponseHeader(payload[:HEADER_LENGTH])
+            view = memoryview(payload)
+            self._header = ResponseHeader(view[:HEADER_LENGTH])
+            self._payload = view if lazy else None
+            if lazy:
+                self._question = self._answer = self._authority = self._additional = None
+                return
             self._question = []
             self._answer = []
             self._authority = []
             self._additional = []
 
-            rest_payload = self._parse_question(payload[HEADER_LENGTH:])
-            rest_payload = self._parse_answer(rest_payload, payload)
-            rest_payload = self._parse_authority(rest_payload, payload)
-            self._parse_additional(rest_payload, payload)
-        except ValueError as e:
+            names = {}
+            offset = self._parse_question(view, HEADER_LENGTH, names)
+            offset = self._parse_answer(view, offset, names=names)
+            offset = self._parse_authority(view, offset, names=names)
+            self._parse_additional(view, offset, names=names)
+        except (ValueError, IndexError, struct.error) as e:
+            raise MalformedDNSResponseException(f"Malformed DNS response") from e
+
+    def _index(self) -> None:
+        """Walks the owner names and rdlength fields of the lazy payload to find where each record starts."""
+        if self._question is not None:
+            return
+        payload = self._payload
+        try:
+            offset = HEADER_LENGTH
+            questions = []
+            for _ in range(self._header.qdcount):
+                questions.append(offset)
+                offset += DomainName.skip(payload, offset) + QUESTION_FIXED_LENGTH
+            sections = []
+            for count in (self._header.ancount, self._header.nscount, self._header.arcount):
+                offsets = []
+                for _ in range(count):
+                    offsets.append(offset)
+                    offset += DomainName.skip(payload, offset)
+                    rdlength, = struct.unpack_from(RR_RDLENGTH_FORMAT, payload, offset + RR_RDLENGTH_OFFSET)
+                    offset += RR_FIXED_LENGTH + rdlength
+                sections.append(offsets)
+            if offset > len(payload):
+                raise ValueError("Truncated DNS response")
+        except (ValueError, IndexError, struct.error) as e:
             raise MalformedDNSResponseException(f"Malformed DNS response") from e
+        names = {}
+        self._answer, self._authority, self._additional = (
+            LazySection(payload, offsets, lambda p, o: self.parse_rr(p, o, names)) for offsets in sections)
+        self._question = LazySection(payload, questions, lambda p, o: Question.from_bytes(p, o, names))
+
+    def _materialize(self) -> None:
+        """Turns lazy sections into plain lists, so that they can be modified."""
+        if self._payload is None:
+            return
+        self._index()
+        self._question = list(self._question)
+        self._answer = list(self._answer)
+        self._authority = list(self._authority)
+        self._additional = list(self._additional)
+        self._payload = None
 
-    def _parse_question(self, payload: bytes) -> bytes:
+    def materialize(self) -> Response:
+        """Decodes every record of a lazy response, raising MalformedDNSResponseException for a malformed one, and
+        drops the received message. Returns the response itself."""
+        self._materialize()
+        return self
+
+    def _parse_question(self, payload: memoryview, offset: int, names: Optional[NameCache] = None) -> int:
         for _ in range(self._header.qdcount):
-            question = Question.from_bytes(payload)
+            question = Question.from_bytes(payload, offset, names)
             self._question.append(question)
-            payload = payload[len(question):]
-        return payload
+            offset += len(question)
+        return offset
 
     @staticmethod
-    def parse_rrs(payload: bytes, original: bytes, count: int, container: List[RR]) -> bytes:
+    def parse_rr(payload: memoryview, offset: int, names: Optional[NameCache] = None) -> RR:
+        name, length = DomainName.from_bytes(payload, offset, names)
+        offset += length
+        return get_rr_type(payload, offset).from_bytes(name, payload, offset, names)
+
+    @staticmethod
+    def parse_rrs(payload: memoryview, offset: int, count: int, container: List[RR],
+                  names: Optional[NameCache] = None) -> int:
+        if names is None:
+            names = {}
         for _ in range(count):
-            name, length = DomainName.from_bytes(payload, original)
-            new_payload = payload[length:]
-            type_ = get_rr_type(new_payload)
-            rr = type_.from_bytes(name, new_payload, original)
+            name, length = DomainName.from_bytes(payload, offset, names)
+            offset += length
+            type_ = get_rr_type(payload, offset)
+            rr = type_.from_bytes(name, payload, offset, names)
             container.append(rr)
-            payload = payload[length + RR_FIXED_LENGTH + rr.rdlength: ]
-
-        return payload
+            offset += RR_FIXED_LENGTH + rr.rdlength
+        if offset > len(payload):
+            raise ValueError("Truncated DNS response")
+        return offset
 
-    def _parse_answer(self, payload: bytes, original: bytes, ancount: Optional[int] = None) -> bytes:
-        return self.parse_rrs(payload, original, ancount if ancount is not None else self._header.ancount, self._answer)
+    def _parse_answer(self, payload: memoryview, offset: int, ancount: Optional[int] = None,
+                      names: Optional[NameCache] = None) -> int:
+        return self.parse_rrs(payload, offset, ancount if ancount is not None else self._header.ancount, self._answer,
+                              names)
 
-    def _parse_authority(self, payload: bytes, original: bytes, nscount: Optional[int] = None) -> bytes:
-        return self.parse_rrs(payload, original, nscount if nscount is not None else self._header.nscount,
-                              self._authority)
+    def _parse_authority(self, payload: memoryview, offset: int, nscount: Optional[int] = None,
+                         names: Optional[NameCache] = None) -> int:
+        return self.parse_rrs(payload, offset, nscount if nscount is not None else self._header.nscount,
+                              self._authority, names)
 
-    def _parse_additional(self, payload: bytes, original: bytes, arcount: Optional[int] = None) -> bytes:
-        return self.parse_rrs(payload, original, arcount if arcount is not None else self._header.arcount,
-                              self._additional)
+    def _parse_additional(self, payload: memoryview, offset: int, arcount: Optional[int] = None,
+                          names: Optional[NameCache] = None) -> int:
+        return self.parse_rrs(payload, offset, arcount if arcount is not None else self._header.arcount,
+                              self._additional, names)
 
     def __repr__(self):
-        return f"Response:\n\tQuestion:\n\t\t" + "\n\t\t".join(repr(q) for q in self._question) + \
-               "\n\tAnswer:\n\t\t" + "\n\t\t".join(repr(a) for a in self._answer) + \
-               "\n\tAuthority:\n\t\t" + "\n\t\t".join(repr(a) for a in self._authority) + \
-               "\n\tAdditional:\n\t\t" + "\n\t\t".join(repr(a) for a in self._additional)
+        return f"Response:\n\tQuestion:\n\t\t" + "\n\t\t".join(repr(q) for q in self.question) + \
+               "\n\tAnswer:\n\t\t" + "\n\t\t".join(repr(a) for a in self.answer) + \
+               "\n\tAuthority:\n\t\t" + "\n\t\t".join(repr(a) for a in self.authority) + \
+               "\n\tAdditional:\n\t\t" + "\n\t\t".join(repr(a) for a in self.additional)
 
     def extend(self, other: Response):
+        self._materialize()
         self._answer.extend(other.answer)
         self._authority.extend(other.authority)
         self._additional.extend(other.additional)
         self._header.extend(other.header)
 
     def add_previous_answer(self, answers: List[RR]):
+        self._materialize()
         self._answer = answers + self._answer
 
+    def aged(self, seconds: int, minimum: int = 0) -> Response:
+        """Copy with the TTLs decreased by `seconds`, but not below `minimum`."""
+        response = copy.copy(self)
+        response._question = list(self.question)
+        response._answer = [rr.aged(seconds, minimum) for rr in self.answer]
+        response._authority = [rr.aged(seconds, minimum) for rr in self.authority]
+        response._additional = [rr.aged(seconds, minimum) for rr in self.additional]
+        response._payload = None
+        return response
+
+    def __bytes__(self):
+        """Encodes the response; a lazy response that has not been modified returns the received message."""
+        if self._payload is not None:
+            return bytes(self._payload)
+        writer = WireWriter()
+        writer.pack(HEADER_FORMAT, self._header.id, self._header.flags, len(self._question), len(self._answer),
+                    len(self._authority), len(self._additional))
+        for question in self._question:
+            question.to_wire(writer)
+        for rr in itertools.chain(self._answer, self._authority, self._additional):
+            rr.to_wire(writer)
+        return bytes(writer)
+
+    def __len__(self):
+        if self._payload is not None:
+            return len(self._payload)
+        return HEADER_LENGTH + sum(len(q) for q in self._question) + sum(len(rr) for rr in self._answer) + \
+            sum(len(rr) for rr in self._authority) + sum(len(rr) for rr in self._additional)
+
+    @property
+    def lazy(self) -> bool:
+        return self._payload is not None
+
     @property
     def header(self):
         return self._header
 
     @property
     def question(self):
+        self._index()
         return self._question
 
     @property
     def answer(self):
+        self._index()
         return self._answer
 
     @property
     def authority(self):
+        self._index()
         return self._authority
 
     @property
     def additional(self):
+        self._index()
         return self._additional
 
+    @property
+    def opt(self) -> Optional[OPT]:
+        """The EDNS(0) OPT record of the response, if the server sent one."""
+        return next((rr for rr in self.additional if isinstance(rr, OPT)), None)
+
     def validate(self):
-        self._header.validate()
+        try:
+            self._header.validate()
+        except DNSError as e:
+            e.response = self
+            raise
         if self._header.qr != QR.RESPONSE:
             raise MalformedDNSResponseException("Response is not a response")
 
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import logging
+import socket
+from typing import Callable, List, Optional, Sequence, Set, Tuple
+
+from AsyncDNSClient import AsyncDNSClient
+from DNSClient import RESOLUTION_ERRORS
+from config import SERVE_ADDRESS, SERVE_PORT, SERVE_RESOLUTION_TIMEOUT_SECONDS, SERVE_MAX_PENDING_QUERIES, \
+    SERVE_TCP_IDLE_TIMEOUT_SECONDS, SERVE_UDP_RECEIVE_BUFFER_SIZE, EDNS_UDP_PAYLOAD_SIZE
+from models import OPCODE, QR, RCODE
+from models.constants import HEADER_FORMAT, HEADER_LENGTH, HEADER_QR_SHIFT, HEADER_OPCODE_MASK, HEADER_TC_SHIFT, \
+    HEADER_RD_MASK, HEADER_RA_SHIFT, HEADER_RCODE_SHIFT, MAX_UDP_PAYLOAD_SIZE, TCP_LENGTH_FIELD_SIZE, \
+    ADDRESS_FAMILY
+from models.exceptions import MalformedDNSResponseException, DNSNameError, InvalidSnapshotException
+from models.question import Question
+from models.rrs import RR, OPT
+from models.wire import WireWriter
+from response.header import ResponseHeader
+from response.response import Response
+from upstream import UpstreamPolicy
+
+SERVFAIL_ERRORS = (*RESOLUTION_ERRORS, MalformedDNSResponseException, asyncio.TimeoutError)
+
+logger = logging.getLogger(__name__)
+
+
+def encode_reply(query: ResponseHeader, questions: List[Question], rcode: RCODE, answer: Sequence[RR] = (),
+                 authority: Sequence[RR] = (), additional: Sequence[RR] = (), edns: bool = False,
+                 limit: Optional[int] = None) -> bytes:
+    """Encodes the reply to `query`, keeping its id, opcode and RD flag. A reply longer than `limit` is replaced by
+    an empty one with the TC flag set, so that the client repeats the query over TCP."""
+    additional = [rr for rr in additional if not isinstance(rr, OPT)]
+    if edns:
+        additional.append(OPT(EDNS_UDP_PAYLOAD_SIZE))
+    tc = False
+    while True:
+        flags = QR.RESPONSE << HEADER_QR_SHIFT | query.flags & (HEADER_OPCODE_MASK | HEADER_RD_MASK) | \
+            tc << HEADER_TC_SHIFT | True << HEADER_RA_SHIFT | rcode << HEADER_RCODE_SHIFT
+        writer = WireWriter()
+        writer.pack(HEADER_FORMAT, query.id, flags, len(questions), len(answer), len(authority), len(additional))
+        for question in questions:
+            question.to_wire(writer)
+        for rr in itertools.chain(answer, authority, additional):
+            rr.to_wire(writer)
+        if limit is None or len(writer) <= limit or tc:
+            return bytes(writer)
+        tc = True
+        answer, authority, additional = [], [], [OPT(EDNS_UDP_PAYLOAD_SIZE)] if edns else []
+
+
+class DNSServer:
+    """Caching DNS server answering the queries of local clients with an `AsyncDNSClient`.
+
+    Every query is resolved in its own task, so a slow upstream only delays the clients waiting for it. Resolutions
+    are bounded by `timeout`, and at most `max_pending` queries are resolved at once; queries above that are dropped
+    and left to the client to retry.
+    """
+    client: AsyncDNSClient
+    address: str
+    port: int
+    timeout: float
+    max_pending: int
+    _tasks: Set[asyncio.Task]
+    _connections: Set[asyncio.StreamWriter]
+    _udp: Optional[asyncio.DatagramTransport]
+    _tcp: Optional[asyncio.AbstractServer]
+
+    def __init__(self, client: AsyncDNSClient, address: str = SERVE_ADDRESS, port: int = SERVE_PORT,
+                 timeout: float = SERVE_RESOLUTION_TIMEOUT_SECONDS, max_pending: int = SERVE_MAX_PENDING_QUERIES):
+        self.client = client
+        self.address = address
+        self.port = port
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._tasks = set()
+        self._connections = set()
+        self._udp = None
+        self._tcp = None
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._udp, _ = await loop.create_datagram_endpoint(lambda: ServerProtocol(self), (self.address, self.port),
+                                                           family=ADDRESS_FAMILY)
+        # A burst of queries arriving between two reads of the socket must not overflow its receive buffer.
+        self._udp.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SERVE_UDP_RECEIVE_BUFFER_SIZE)
+        self.port = self._udp.get_extra_info('sockname')[1]
+        self._tcp = await asyncio.start_server(self.handle_connection, self.address, self.port, family=ADDRESS_FAMILY)
+
+    async def serve_forever(self) -> None:
+        if self._tcp is None:
+            await self.start()
+        await self._tcp.serve_forever()
+
+    def submit(self, payload: bytes, reply: Callable[[bytes], None], limit: Optional[int]) -> Optional[asyncio.Task]:
+        """Starts answering `payload`, passing the encoded reply to `reply`."""
+        if len(self._tasks) >= self.max_pending:
+            return None
+        task = asyncio.ensure_future(self.answer(payload, limit))
+        self._tasks.add(task)
+
+        def done(t: asyncio.Task):
+            self._tasks.discard(t)
+            if not t.cancelled() and t.exception() is None and t.result() is not None:
+                reply(t.result())
+        task.add_done_callback(done)
+        return task
+
+    async def answer(self, payload: bytes, limit: Optional[int] = None) -> Optional[bytes]:
+        """Reply to the query in `payload`, None for messages that get no reply. `limit` is None for queries received
+        over TCP."""
+        try:
+            message = Response(payload, lazy=True)
+        except MalformedDNSResponseException:
+            return None
+        query = message.header
+        if query.qr is not QR.QUERY:
+            return None
+        try:
+            questions = list(message.question)
+            opt = message.opt
+        except MalformedDNSResponseException:
+            return encode_reply(query, [], RCODE.FORMAT_ERROR)
+        edns = opt is not None
+        if limit is not None and edns:
+            limit = min(max(opt.payload_size, MAX_UDP_PAYLOAD_SIZE), EDNS_UDP_PAYLOAD_SIZE)
+        if query.opcode is not OPCODE.QUERY:
+            return encode_reply(query, questions, RCODE.NOT_IMPLEMENTED, edns=edns)
+        if len(questions) != 1:
+            return encode_reply(query, questions, RCODE.FORMAT_ERROR, edns=edns)
+
+        question = questions[0]
+        try:
+            response = await self.client.retrieve(question.qname.name, question.qtype, question.qclass, self.timeout)
+        except DNSNameError as e:
+            authority = e.response.authority if e.response is not None else []
+            return encode_reply(query, questions, RCODE.NAME_ERROR, authority=authority, edns=edns, limit=limit)
+        except SERVFAIL_ERRORS:
+            return encode_reply(query, questions, RCODE.SERVER_FAILURE, edns=edns)
+        except Exception:
+            # A bug, not a failed resolution: log it, but still answer rather than leave the client to time out.
+            logger.exception('Resolving %s failed', question)
+            return encode_reply(query, questions, RCODE.SERVER_FAILURE, edns=edns)
+        return encode_reply(query, questions, RCODE.NO_ERROR, response.answer, response.authority, response.additional,
+                            edns, limit)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serves the queries of one TCP client. Queries may be pipelined and are answered as they resolve, not
+        necessarily in order (RFC 7766 6.2.1.1)."""
+        def reply(data: bytes):
+            if not writer.is_closing():
+                writer.write(len(data).to_bytes(TCP_LENGTH_FIELD_SIZE, 'big') + data)
+
+        pending = set()
+        self._connections.add(writer)
+        try:
+            while True:
+                length = await asyncio.wait_for(reader.readexactly(TCP_LENGTH_FIELD_SIZE),
+                                                SERVE_TCP_IDLE_TIMEOUT_SECONDS)
+                payload = await asyncio.wait_for(reader.readexactly(int.from_bytes(length, 'big')),
+                                                 SERVE_TCP_IDLE_TIMEOUT_SECONDS)
+                task = self.submit(payload, reply, None) if len(payload) >= HEADER_LENGTH else None
+                if task is not None:
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            if pending:
+                await asyncio.wait(pending)
+            writer.close()
+
+    def close(self) -> None:
+        if self._udp is not None:
+            self._udp.close()
+        if self._tcp is not None:
+            self._tcp.close()
+        for task in self._tasks:
+            task.cancel()
+        # Closing the transport ends the read loop of the handle_connection serving it.
+        for writer in self._connections:
+            writer.close()
+
+
+class ServerProtocol(asyncio.DatagramProtocol):
+    server: DNSServer
+    transport: Optional[asyncio.DatagramTransport]
+
+    def __init__(self, server: DNSServer):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        if len(data) >= HEADER_LENGTH:
+            self.server.submit(data, lambda reply: self.transport.sendto(reply, addr), MAX_UDP_PAYLOAD_SIZE)
+
+
+async def main(args: argparse.Namespace) -> None:
+    client = AsyncDNSClient(upstreams=args.upstream or None, upstream_policy=UpstreamPolicy(args.policy))
+    if args.snapshot:
+        try:
+            client.load_snapshot(args.snapshot)
+        except (OSError, InvalidSnapshotException):
+            pass
+    server = DNSServer(client, args.address, args.port)
+    await server.start()
+    print(f'Listening on {server.address}:{server.port}')
+    try:
+        await server.serve_forever()
+    finally:
+        server.close()
+        if args.snapshot:
+            client.save_snapshot(args.snapshot)
+        client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Caching DNS server answering through DNSClient.')
+    parser.add_argument('--address', default=SERVE_ADDRESS)
+    parser.add_argument('--port', type=int, default=SERVE_PORT)
+    parser.add_argument('--upstream', action='append', help='forward to this resolver instead of iterating')
+    parser.add_argument('--policy', default=UpstreamPolicy.LOWEST_SRTT.value,
+                        choices=[policy.value for policy in UpstreamPolicy])
+    parser.add_argument('--snapshot', help='cache snapshot loaded at startup and saved at shutdown')
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from config import UNKNOWN_SERVER_SRTT_SECONDS, SERVER_FAILURE_PENALTY_SECONDS, SERVER_PENALTY_HALF_LIFE_SECONDS, \
+    INITIAL_RTO_SECONDS, MIN_RTO_SECONDS, MAX_RTO_SECONDS, MAX_SERVER_STATS
+from utils import Authority
+
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+RTO_K = 4
+RTO_GRANULARITY_SECONDS = 0.01
+RTO_MAX_BACKOFF = 6
+
+
+class ServerStats:
+    address: str
+    srtt: Optional[float]
+    rttvar: Optional[float]
+    failures: int
+    queries: int
+    edns: bool
+    updated: float
+
+    def __init__(self, address: str):
+        self.address = address
+        self.srtt = None
+        self.rttvar = None
+        self.failures = 0
+        self.queries = 0
+        self.edns = True
+        self.updated = time.monotonic()
+
+    def record_rtt(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.failures = 0
+        self.queries += 1
+        self.updated = time.monotonic()
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.queries += 1
+        self.updated = time.monotonic()
+
+    def score(self) -> float:
+        """Expected cost of querying the server: the measured SRTT plus a failure penalty that decays with time, so
+        that failed servers get retried."""
+        srtt = self.srtt if self.srtt is not None else UNKNOWN_SERVER_SRTT_SECONDS
+        penalty = self.failures * SERVER_FAILURE_PENALTY_SECONDS
+        decay = 0.5 ** ((time.monotonic() - self.updated) / SERVER_PENALTY_HALF_LIFE_SECONDS)
+        return srtt + penalty * decay
+
+    def rto(self, attempt: int = 0) -> float:
+        """Retransmission timeout as in RFC 6298 with exponential backoff, clamped to the configured limits."""
+        if self.srtt is None:
+            rto = INITIAL_RTO_SECONDS
+        else:
+            rto = self.srtt + max(RTO_GRANULARITY_SECONDS, RTO_K * self.rttvar)
+        rto *= 2 ** min(max(attempt, self.failures), RTO_MAX_BACKOFF)
+        return min(max(rto, MIN_RTO_SECONDS), MAX_RTO_SECONDS)
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        return {'srtt': self.srtt, 'rttvar': self.rttvar, 'failures': self.failures, 'queries': self.queries,
+                'edns': self.edns, 'score': self.score(), 'rto': self.rto()}
+
+    def __repr__(self):
+        return f"ServerStats({self.address}, srtt={self.srtt}, failures={self.failures})"
+
+
+class ServerStatsTable:
+    """Smoothed RTT and failure counters per nameserver address, used to order candidate authorities.
+
+    At most `max_servers` addresses are tracked; the least recently updated ones are forgotten first.
+    """
+    max_servers: int
+    _servers: OrderedDict[str, ServerStats]
+
+    def __init__(self, max_servers: int = MAX_SERVER_STATS):
+        self.max_servers = max_servers
+        self._servers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, address: str) -> ServerStats:
+        with self._lock:
+            stats = self._servers.get(address)
+            if stats is None:
+                stats = self._servers[address] = ServerStats(address)
+                if len(self._servers) > self.max_servers:
+                    self._servers.popitem(last=False)
+            else:
+                self._servers.move_to_end(address)
+            return stats
+
+    def record_rtt(self, address: str, rtt: float) -> None:
+        stats = self.get(address)
+        with self._lock:
+            stats.record_rtt(rtt)
+
+    def record_failure(self, address: str) -> None:
+        stats = self.get(address)
+        with self._lock:
+            stats.record_failure()
+
+    def score(self, address: str) -> float:
+        stats = self._servers.get(address)
+        return stats.score() if stats is not None else UNKNOWN_SERVER_SRTT_SECONDS
+
+    def rto(self, address: str, attempt: int = 0) -> float:
+        stats = self._servers.get(address)
+        if stats is None:
+            stats = ServerStats(address)
+        return stats.rto(attempt)
+
+    def edns(self, address: str) -> bool:
+        stats = self._servers.get(address)
+        return stats is None or stats.edns
+
+    def record_edns_failure(self, address: str) -> None:
+        """Remembers that the server rejected an EDNS(0) query, so later queries to it are sent without OPT."""
+        stats = self.get(address)
+        with self._lock:
+            stats.edns = False
+
+    def order(self, authorities: Iterable[Authority]) -> List[Authority]:
+        return sorted(authorities, key=lambda authority: self.score(authority.address))
+
+    def snapshot(self) -> Dict[str, Dict[str, Optional[float]]]:
+        with self._lock:
+            return {address: stats.as_dict() for address, stats in self._servers.items()}
+
+    def __contains__(self, address: str):
+        return address in self._servers
+
+    def __len__(self):
+        return len(self._servers)
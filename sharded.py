@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cache import SharedAnswerCache
+from config import BULK_CONCURRENCY, SHARDED_WORKERS, SHARED_CACHE_SLOTS, SHARED_CACHE_SLOT_SIZE
+from DNSClient import DNSClient, BulkQuery, Resolution
+from models import QTYPE, QCLASS, RCODE
+from models.exceptions import DNSNameError, RetrievalException, NoRespondingServersException, \
+    DeadlineExceededException
+from models.question import Question
+from response import Response
+
+# (id, name, qtype, qclass, deadline) sent to a worker, (id, encoded response, error type, error message) sent back.
+Job = Tuple[int, str, QTYPE, QCLASS, Optional[float]]
+Result = Tuple[int, Optional[bytes], Optional[str], Optional[str]]
+
+BULK_QUERY_DEFAULTS = (None, QTYPE.A, QCLASS.IN)
+
+WORKER_ERRORS = {
+    NoRespondingServersException.__name__: lambda message: NoRespondingServersException(),
+    DeadlineExceededException.__name__: lambda message: DeadlineExceededException(),
+}
+
+
+def _worker_main(shards: int, slots: int, slot_size: int, cache_name: str, inbox: multiprocessing.Queue,
+                 outbox: multiprocessing.Queue, concurrency: int, client_options: dict) -> None:
+    """Resolves the jobs of one shard with a private DNSClient, publishing the answers in the shared cache."""
+    cache = SharedAnswerCache(shards, slots, slot_size, cache_name)
+    client = DNSClient(**client_options)
+
+    def run(job: Job) -> None:
+        id_, name, qtype, qclass, deadline = job
+        question = Question(name, qtype, qclass)
+        try:
+            response = client.retrieve(name, qtype, qclass, deadline)
+        except DNSNameError as e:
+            if e.response is not None:
+                cache.put(question, e.response)
+            outbox.put((id_, bytes(e.response) if e.response is not None else None, DNSNameError.__name__, str(e)))
+        except Exception as e:
+            outbox.put((id_, None, type(e).__name__, str(e)))
+        else:
+            cache.put(question, response)
+            outbox.put((id_, bytes(response), None, None))
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        for job in iter(inbox.get, None):
+            executor.submit(run, job)
+    client.close()
+    cache.close()
+
+
+class ShardedResolver:
+    """Resolver spreading questions over worker processes, so that parsing and encoding use more than one core.
+
+    Questions are sharded by a hash of the query name, each worker resolving its shard with its own DNSClient; the
+    same name thus always reaches the same worker, which keeps its private delegation table and cache warm and
+    coalesces repeated lookups. Workers publish their answers in a SharedAnswerCache that this process reads before
+    dispatching a question, so cached names are answered without a round trip to a worker.
+
+    Workers are started with the spawn method, so a program creating a ShardedResolver has to guard its entry point
+    with `if __name__ == '__main__'`.
+    """
+    workers: int
+    cache: SharedAnswerCache
+    _processes: List[multiprocessing.Process]
+    _inboxes: List[multiprocessing.Queue]
+    _pending: Dict[int, Tuple[Question, Future]]
+
+    def __init__(self, workers: Optional[int] = SHARDED_WORKERS, concurrency: int = BULK_CONCURRENCY,
+                 slots: int = SHARED_CACHE_SLOTS, slot_size: int = SHARED_CACHE_SLOT_SIZE, **client_options):
+        """`concurrency` is the number of resolutions each worker runs at once; `client_options` are passed to the
+        DNSClient of every worker."""
+        self.workers = workers or os.cpu_count()
+        self.cache = SharedAnswerCache(self.workers, slots, slot_size)
+        context = multiprocessing.get_context('spawn')
+        self._outbox = context.Queue()
+        self._inboxes = []
+        self._processes = []
+        for _ in range(self.workers):
+            inbox = context.Queue()
+            process = context.Process(target=_worker_main, daemon=True,
+                                      args=(self.workers, slots, slot_size, self.cache.name, inbox, self._outbox,
+                                            concurrency, client_options))
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        self._pending = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def __del__(self):
+        self.close()
+
+    def lookup_cache(self, question: Question) -> Optional[Response]:
+        cached = self.cache.get(question)
+        if cached is not None and cached.header.rcode is RCODE.NAME_ERROR:
+            raise DNSNameError(question.qname.name, cached)
+        return cached
+
+    def submit(self, name: str, qtype: QTYPE = QTYPE.A, qclass: QCLASS = QCLASS.IN,
+               deadline: Optional[float] = None) -> Future:
+        """Future of the response to the question; resolved at once from the shared cache where possible."""
+        question = Question(name, qtype, qclass)
+        future = Future()
+        try:
+            cached = self.lookup_cache(question)
+        except DNSNameError as e:
+            future.set_exception(e)
+            return future
+        if cached is not None:
+            future.set_result(cached)
+            return future
+        id_ = next(self._ids)
+        with self._lock:
+            self._pending[id_] = question, future
+        self._inboxes[self.cache.shard_of(question.qname)].put((id_, name, qtype, qclass, deadline))
+        return future
+
+    def retrieve(self, name: str, qtype: QTYPE = QTYPE.A, qclass: QCLASS = QCLASS.IN,
+                 deadline: Optional[float] = None) -> Response:
+        return self.submit(name, qtype, qclass, deadline).result()
+
+    def retrieve_many(self, queries: Iterable[BulkQuery], concurrency: Optional[int] = None,
+                      deadline: Optional[float] = None) -> Iterator[Resolution]:
+        """Like DNSClient.retrieve_many; by default `concurrency` keeps BULK_CONCURRENCY questions per worker in
+        flight."""
+        concurrency = concurrency or BULK_CONCURRENCY * self.workers
+        pending = {}
+        for query in queries:
+            if len(pending) >= concurrency:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from (self._resolution(pending.pop(future), future) for future in done)
+            name, qtype, qclass = (*query, *BULK_QUERY_DEFAULTS[len(query):])
+            pending[self.submit(name, qtype, qclass, deadline)] = Question(name, qtype, qclass)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from (self._resolution(pending.pop(future), future) for future in done)
+
+    @staticmethod
+    def _resolution(question: Question, future: Future) -> Resolution:
+        error = future.exception()
+        if error is not None:
+            return Resolution(question, error=error)
+        return Resolution(question, future.result())
+
+    def _collect(self) -> None:
+        for id_, payload, error, message in iter(self._outbox.get, None):
+            with self._lock:
+                question, future = self._pending.pop(id_)
+            response = Response(payload, lazy=True) if payload is not None else None
+            if error is None:
+                future.set_result(response)
+            elif error == DNSNameError.__name__:
+                future.set_exception(DNSNameError(question.qname.name, response))
+            else:
+                future.set_exception(WORKER_ERRORS.get(error, RetrievalException)(message))
+
+    def close(self) -> None:
+        if not getattr(self, '_processes', None):
+            return
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            process.join()
+        self._outbox.put(None)
+        self._collector.join()
+        self._processes = []
+        self.cache.close()
+        self.cache.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
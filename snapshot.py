@@ -0,0 +1,134 @@
+"""Binary snapshots of the answer cache and the delegation table, used to warm up a client after a restart.
+
+All integers are big-endian. The file starts with a header:
+
+    magic (8 bytes), saved at (f64, POSIX time), entry count (u32), authority count (u32)
+
+followed by the cache entries, least recently used first:
+
+    stored (f64), expiration (f64), question length (u16), response length (u32), question, response
+
+and by the authorities:
+
+    expiration (f64, inf if static), zone length (u16), nsdname length (u16), address length (u8),
+    zone, nsdname, address
+
+Questions and responses are kept in wire format and expiry times are absolute, so a snapshot can be memory-mapped and
+loaded without re-resolving anything. Responses are parsed lazily straight from the mapping.
+"""
+from __future__ import annotations
+
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from datetime import datetime
+from typing import Tuple
+
+from cache import AnswerCache, CacheEntry
+from models import DomainName
+from models.exceptions import InvalidSnapshotException, MalformedDNSResponseException
+from models.question import Question
+from response import Response
+from utils import Authority, AuthorityTable
+
+SNAPSHOT_MAGIC = b'DNSSNAP\x01'
+SNAPSHOT_HEADER_FORMAT = '>8sdII'
+SNAPSHOT_ENTRY_FORMAT = '>ddHI'
+SNAPSHOT_AUTHORITY_FORMAT = '>dHHB'
+NAME_ENCODING = 'latin-1'
+
+
+def _timestamp(moment: datetime) -> float:
+    return math.inf if moment == datetime.max else moment.timestamp()
+
+
+def _datetime(timestamp: float) -> datetime:
+    return datetime.max if math.isinf(timestamp) else datetime.fromtimestamp(timestamp)
+
+
+def save_snapshot(path: str, cache: AnswerCache, authorities: AuthorityTable) -> None:
+    """Writes the unexpired cache entries and authorities to `path`, atomically replacing the previous snapshot."""
+    entries = cache.entries()
+    delegations = [auth for _, zone_authorities in authorities.zones() for auth in zone_authorities]
+    chunks = [struct.pack(SNAPSHOT_HEADER_FORMAT, SNAPSHOT_MAGIC, time.time(), len(entries), len(delegations))]
+    for question, entry in entries:
+        question_wire, response_wire = bytes(question), bytes(entry.response)
+        chunks.append(struct.pack(SNAPSHOT_ENTRY_FORMAT, _timestamp(entry.stored), _timestamp(entry.expiration),
+                                  len(question_wire), len(response_wire)))
+        chunks += (question_wire, response_wire)
+    for auth in delegations:
+        zone, nsdname = auth.name.name.encode(NAME_ENCODING), auth.nsdname.name.encode(NAME_ENCODING)
+        address = (auth.address or '').encode(NAME_ENCODING)
+        chunks.append(struct.pack(SNAPSHOT_AUTHORITY_FORMAT, _timestamp(auth.expiration), len(zone), len(nsdname),
+                                  len(address)))
+        chunks += (zone, nsdname, address)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.writelines(chunks)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def load_snapshot(path: str, cache: AnswerCache, authorities: AuthorityTable) -> Tuple[int, int]:
+    """Loads a snapshot written by save_snapshot, skipping everything that has expired since.
+
+    Returns the number of cache entries and authorities restored. The responses keep referencing the memory-mapped
+    file, which is unmapped once none of them is cached anymore.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise InvalidSnapshotException('empty snapshot')
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    try:
+        magic, _, entry_count, authority_count = struct.unpack_from(SNAPSHOT_HEADER_FORMAT, view)
+        if magic != SNAPSHOT_MAGIC:
+            raise InvalidSnapshotException('not a snapshot or unsupported version')
+        offset = struct.calcsize(SNAPSHOT_HEADER_FORMAT)
+        now = time.time()
+
+        restored_entries = 0
+        for _ in range(entry_count):
+            stored, expiration, question_length, response_length = \
+                struct.unpack_from(SNAPSHOT_ENTRY_FORMAT, view, offset)
+            offset += struct.calcsize(SNAPSHOT_ENTRY_FORMAT)
+            question_start, response_start = offset, offset + question_length
+            offset = response_start + response_length
+            if offset > len(view):
+                raise InvalidSnapshotException('truncated snapshot')
+            if expiration <= now:
+                continue
+            question = Question.from_bytes(view, question_start)
+            response = Response(view[response_start:offset], lazy=True)
+            cache.restore(question, CacheEntry.restore(response, _datetime(stored), _datetime(expiration)))
+            restored_entries += 1
+
+        restored_authorities = 0
+        for _ in range(authority_count):
+            expiration, zone_length, nsdname_length, address_length = \
+                struct.unpack_from(SNAPSHOT_AUTHORITY_FORMAT, view, offset)
+            offset += struct.calcsize(SNAPSHOT_AUTHORITY_FORMAT)
+            zone = str(view[offset:offset + zone_length], NAME_ENCODING)
+            offset += zone_length
+            nsdname = str(view[offset:offset + nsdname_length], NAME_ENCODING)
+            offset += nsdname_length
+            address = str(view[offset:offset + address_length], NAME_ENCODING) or None
+            offset += address_length
+            if offset > len(view):
+                raise InvalidSnapshotException('truncated snapshot')
+            if expiration <= now:
+                continue
+            authority = Authority(DomainName.intern(zone), DomainName.intern(nsdname), address)
+            authority.expiration = _datetime(expiration)
+            authorities.add(authority)
+            restored_authorities += 1
+    except (struct.error, ValueError, IndexError, MalformedDNSResponseException) as e:
+        raise InvalidSnapshotException('malformed snapshot') from e
+    return restored_entries, restored_authorities
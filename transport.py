@@ -0,0 +1,488 @@
+from __future__ import annotations
+
+import contextlib
+import itertools
+import queue
+import secrets
+import select
+import socket
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import MAX_SENDING_WAIT_TIME_SECONDS, UDP_SOCKET_POOL_SIZE, UDP_SOCKET_MAX_QUERIES, TCP_POOL_SIZE, \
+    TCP_IDLE_TIMEOUT_SECONDS
+from models.constants import ADDRESS_FAMILY, PROTOCOL, PORT, UDP_RECEIVE_BUFFER_SIZE, TCP_LENGTH_FIELD_SIZE, \
+    TCP_RECEIVE_BUFFER_SIZE, HEADER_ID_SECTION_LENGTH_BITS
+from models.exceptions import MalformedDNSResponseException
+from models.question import Question
+from request import Request
+from response import Response
+from server_stats import ServerStatsTable
+from utils import check_response
+
+QueryKey = Tuple[str, int, Tuple[Question, ...]]
+
+
+def random_id() -> int:
+    """Unpredictable query id; together with the source port it is what an off-path attacker has to guess to spoof
+    a response (RFC 5452 9.2)."""
+    return secrets.randbits(HEADER_ID_SECTION_LENGTH_BITS)
+
+
+def query_key(address: str, request: Request) -> QueryKey:
+    return address, request.id, tuple(request.question)
+
+
+def claim_id(request: Request, taken: Callable[[Request], bool]) -> None:
+    """Draws new ids for `request` until `taken` is False. A request already on the wire keeps its id, since
+    responses to it may still arrive; it cannot be sent again while its id is taken."""
+    while taken(request):
+        if request.sent:
+            raise ConnectionError('Query id already in use')
+        request.id = random_id()
+
+
+class PendingQuery:
+    address: str
+    request: Request
+    results: queue.Queue
+    key: QueryKey
+    sock: Optional[socket.socket]
+    sent_at: Optional[float]
+
+    def __init__(self, address: str, request: Request, results: queue.Queue):
+        self.address = address
+        self.request = request
+        self.results = results
+        self.key = query_key(address, request)
+        self.sock = None
+        self.sent_at = None
+
+
+class Wakeup:
+    """Socket pair that interrupts a reader thread blocked in select() from another thread."""
+    _reader: socket.socket
+    _writer: socket.socket
+
+    def __init__(self):
+        self._reader, self._writer = socket.socketpair()
+        self._reader.setblocking(False)
+        self._writer.setblocking(False)
+
+    def fileno(self) -> int:
+        return self._reader.fileno()
+
+    def set(self) -> None:
+        # A full buffer already guarantees a pending wakeup.
+        with contextlib.suppress(OSError):
+            self._writer.send(b'\0')
+
+    def clear(self) -> None:
+        with contextlib.suppress(OSError):
+            while self._reader.recv(4096):
+                pass
+
+    def close(self) -> None:
+        self._reader.close()
+        self._writer.close()
+
+
+class UDPTransport:
+    """Small pool of UDP sockets shared by all resolvers of a client.
+
+    Outstanding queries are kept in a table keyed by (server, id, question). A single receiver thread reads every
+    socket of the pool and hands each valid response to the queue of the query waiting for it.
+
+    Query ids are random and every socket is replaced by one bound to a new ephemeral port after sending
+    `max_queries` queries, so that neither the id nor the source port of a query can be predicted (RFC 5452). A
+    replaced socket is still read until the queries sent from it are answered or cancelled.
+    """
+    pool_size: int
+    max_queries: int
+    receive_size: int
+    stats: Optional[ServerStatsTable]
+    _socks: List[socket.socket]
+    _uses: List[int]
+    _retired: List[socket.socket]
+    _in_flight: Dict[socket.socket, int]
+    _pending: Dict[QueryKey, PendingQuery]
+    _receiver: Optional[threading.Thread]
+    _wakeup: Optional[Wakeup]
+
+    def __init__(self, pool_size: int = UDP_SOCKET_POOL_SIZE, stats: Optional[ServerStatsTable] = None,
+                 receive_size: int = UDP_RECEIVE_BUFFER_SIZE, max_queries: int = UDP_SOCKET_MAX_QUERIES):
+        self.pool_size = pool_size
+        self.max_queries = max_queries
+        self.receive_size = receive_size
+        self.stats = stats
+        self._socks = []
+        self._uses = []
+        self._retired = []
+        self._in_flight = {}
+        self._pending = {}
+        self._receiver = None
+        self._wakeup = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._next_sock = itertools.cycle(range(pool_size))
+
+    @staticmethod
+    def _open_socket() -> socket.socket:
+        sock = socket.socket(ADDRESS_FAMILY, PROTOCOL)
+        sock.setblocking(False)
+        return sock
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._receiver is not None:
+                return
+            self._socks = [self._open_socket() for _ in range(self.pool_size)]
+            self._uses = [0] * self.pool_size
+            self._wakeup = Wakeup()
+            self._receiver = threading.Thread(target=self._receive_loop, daemon=True)
+            self._receiver.start()
+
+    def _socket(self) -> socket.socket:
+        """Socket to send the next query from, rotating to a new source port when it is due. Called with the lock
+        held."""
+        i = next(self._next_sock)
+        if self._uses[i] >= self.max_queries:
+            self._retired.append(self._socks[i])
+            self._socks[i] = self._open_socket()
+            self._uses[i] = 0
+            self._wakeup.set()
+        self._uses[i] += 1
+        return self._socks[i]
+
+    def _register(self, pending: PendingQuery) -> None:
+        """Adds `pending` to the table, drawing a new id while its key is taken. Called with the lock held."""
+        claim_id(pending.request, lambda request: query_key(pending.address, request) in self._pending)
+        pending.key = query_key(pending.address, pending.request)
+        pending.sock = self._socket()
+        self._pending[pending.key] = pending
+        self._in_flight[pending.sock] = self._in_flight.get(pending.sock, 0) + 1
+
+    def _unregister(self, pending: PendingQuery) -> None:
+        """Called with the lock held."""
+        self._pending.pop(pending.key)
+        self._in_flight[pending.sock] -= 1
+        if not self._in_flight[pending.sock]:
+            self._in_flight.pop(pending.sock)
+            if pending.sock in self._retired:
+                self._wakeup.set()
+
+    def send(self, address: str, request: Request, results: queue.Queue) -> PendingQuery:
+        self._start()
+        pending = PendingQuery(address, request, results)
+        with self._lock:
+            self._register(pending)
+        sock = pending.sock
+        try:
+            if not select.select([], [sock], [], MAX_SENDING_WAIT_TIME_SECONDS)[1]:
+                raise TimeoutError()
+            pending.sent_at = time.monotonic()
+            size = sock.sendto(bytes(request), (address, PORT))
+            request.mark_sent()
+            if not size:
+                raise ConnectionError('Cannot send request')
+        except BaseException:
+            self.cancel(pending)
+            raise
+        return pending
+
+    def cancel(self, pending: PendingQuery) -> None:
+        with self._lock:
+            if self._pending.get(pending.key) is pending:
+                self._unregister(pending)
+
+    def query(self, address: str, request: Request, timeout: float) -> Response:
+        response, _ = self.query_any([address], request, timeout)
+        return response
+
+    def query_any(self, addresses: List[str], request: Request, timeout: float, stagger: Optional[float] = None) \
+            -> Tuple[Response, str]:
+        """Send `request` to the first address and, every `stagger` seconds without an answer, to the next one.
+
+        The first valid response wins and the remaining queries are cancelled. `timeout` bounds the whole exchange.
+        """
+        results = queue.Queue()
+        sent = []
+        deadline = time.monotonic() + timeout
+        try:
+            for i, address in enumerate(addresses):
+                sent.append(self.send(address, request, results))
+                remaining = deadline - time.monotonic()
+                wait = remaining if stagger is None or i == len(addresses) - 1 else min(stagger, remaining)
+                try:
+                    pending, response = results.get(timeout=max(wait, 0))
+                    return response, pending.address
+                except queue.Empty:
+                    if time.monotonic() >= deadline:
+                        break
+            if self.stats is not None:
+                for pending in sent:
+                    self.stats.record_failure(pending.address)
+            raise TimeoutError()
+        finally:
+            for pending in sent:
+                self.cancel(pending)
+
+    def _receive_loop(self) -> None:
+        while not self._closed:
+            with self._lock:
+                drained = [sock for sock in self._retired if sock not in self._in_flight]
+                self._retired = [sock for sock in self._retired if sock in self._in_flight]
+                socks = self._socks + self._retired
+            for sock in drained:
+                sock.close()
+            try:
+                readable = select.select([self._wakeup, *socks], [], [])[0]
+            except (OSError, ValueError):
+                return
+            for sock in readable:
+                if sock is self._wakeup:
+                    self._wakeup.clear()
+                    continue
+                try:
+                    payload, addr = sock.recvfrom(self.receive_size)
+                except OSError:
+                    continue
+                self._dispatch(payload, addr[0])
+
+    def _dispatch(self, payload: bytes, address: str) -> None:
+        try:
+            response = Response(payload, lazy=True)
+            key = address, response.header.id, tuple(response.question)
+        except MalformedDNSResponseException:
+            return
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                self._unregister(pending)
+        if pending is not None and check_response(pending.request, response):
+            if self.stats is not None:
+                self.stats.record_rtt(address, time.monotonic() - pending.sent_at)
+            pending.results.put((pending, response))
+
+    def close(self) -> None:
+        self._closed = True
+        if self._receiver is not None:
+            self._wakeup.set()
+            if self._receiver is not threading.current_thread():
+                self._receiver.join()
+            self._wakeup.close()
+        for sock in self._socks + self._retired:
+            sock.close()
+        self._socks = []
+        self._retired = []
+
+
+class TCPConnection:
+    address: str
+    sock: socket.socket
+    last_used: float
+    closed: bool
+    _buffer: bytearray
+    _pending: Dict[int, PendingQuery]
+
+    def __init__(self, address: str, connect_timeout: float):
+        self.address = address
+        self.sock = socket.create_connection((address, PORT), timeout=connect_timeout)
+        self.sock.setblocking(False)
+        self.last_used = time.monotonic()
+        self.closed = False
+        self._buffer = bytearray()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def idle(self) -> bool:
+        return not self._pending
+
+    def send(self, request: Request, results: queue.Queue, timeout: float) -> PendingQuery:
+        pending = PendingQuery(self.address, request, results)
+        with self._lock:
+            if self.closed:
+                raise ConnectionError('Connection closed')
+            claim_id(request, lambda r: r.id in self._pending)
+            req = bytes(request)
+            self._pending[request.id] = pending
+            self.last_used = time.monotonic()
+            try:
+                self.sock.settimeout(timeout)
+                pending.sent_at = time.monotonic()
+                self.sock.sendall(len(req).to_bytes(TCP_LENGTH_FIELD_SIZE, 'big') + req)
+                error = None
+            except OSError as e:
+                self._pending.pop(request.id, None)
+                error = e
+            finally:
+                self.sock.setblocking(False)
+        if error is not None:
+            # Part of the message may have been written, so the stream is out of sync for every later query.
+            self.close(error)
+            raise error
+        request.mark_sent()
+        return pending
+
+    def cancel(self, pending: PendingQuery) -> None:
+        with self._lock:
+            if self._pending.get(pending.request.id) is pending:
+                self._pending.pop(pending.request.id)
+
+    def read(self) -> None:
+        try:
+            data = self.sock.recv(TCP_RECEIVE_BUFFER_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.close(e)
+            return
+        if not data:
+            self.close(ConnectionError('Connection closed by server'))
+            return
+        self._buffer += data
+        while len(self._buffer) >= TCP_LENGTH_FIELD_SIZE:
+            length = int.from_bytes(self._buffer[:TCP_LENGTH_FIELD_SIZE], 'big')
+            if len(self._buffer) < TCP_LENGTH_FIELD_SIZE + length:
+                break
+            payload = bytes(self._buffer[TCP_LENGTH_FIELD_SIZE:TCP_LENGTH_FIELD_SIZE + length])
+            del self._buffer[:TCP_LENGTH_FIELD_SIZE + length]
+            self._dispatch(payload)
+
+    def _dispatch(self, payload: bytes) -> None:
+        try:
+            response = Response(payload, lazy=True)
+            response.question
+        except MalformedDNSResponseException:
+            return
+        with self._lock:
+            pending = self._pending.pop(response.header.id, None)
+            self.last_used = time.monotonic()
+        if pending is not None and check_response(pending.request, response):
+            pending.results.put((pending, response))
+
+    def close(self, error: Optional[Exception] = None) -> None:
+        with self._lock:
+            self.closed = True
+            pending, self._pending = self._pending, {}
+        for p in pending.values():
+            p.results.put((p, error or ConnectionError('Connection closed')))
+        with contextlib.suppress(OSError):
+            self.sock.shutdown(socket.SHUT_RDWR)
+        self.sock.close()
+
+
+class TCPConnectionPool:
+    """Persistent TCP connections to nameservers as described in RFC 7766.
+
+    Queries to the same server are pipelined over one connection and matched to their responses by id. Connections
+    idle for longer than `idle_timeout` are closed, and at most `max_connections` are kept open.
+    """
+    max_connections: int
+    idle_timeout: float
+    _connections: OrderedDict[str, TCPConnection]
+    _reader: Optional[threading.Thread]
+    _wakeup: Optional[Wakeup]
+
+    def __init__(self, max_connections: int = TCP_POOL_SIZE, idle_timeout: float = TCP_IDLE_TIMEOUT_SECONDS):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._connections = OrderedDict()
+        self._reader = None
+        self._wakeup = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _connection(self, address: str, connect_timeout: float) -> TCPConnection:
+        with self._lock:
+            connection = self._connections.get(address)
+            if connection is not None and not connection.closed:
+                self._connections.move_to_end(address)
+                return connection
+        connection = TCPConnection(address, connect_timeout)
+        with self._lock:
+            previous = self._connections.get(address)
+            if previous is not None and not previous.closed:
+                # Another thread connected to the same server meanwhile; share its connection.
+                self._connections.move_to_end(address)
+                evicted, connection = [connection], previous
+            else:
+                evicted = [self._connections.pop(address)] if previous is not None else []
+                self._connections[address] = connection
+            for other in list(self._connections.values()):
+                if len(self._connections) <= self.max_connections:
+                    break
+                if other is not connection and other.idle:
+                    evicted.append(self._connections.pop(other.address))
+            if self._reader is None:
+                self._wakeup = Wakeup()
+                self._reader = threading.Thread(target=self._read_loop, daemon=True)
+                self._reader.start()
+            else:
+                self._wakeup.set()
+        for other in evicted:
+            other.close()
+        return connection
+
+    def query(self, address: str, request: Request, timeout: float, connect_timeout: float) -> Response:
+        connection = self._connection(address, connect_timeout)
+        results = queue.Queue()
+        pending = connection.send(request, results, timeout)
+        try:
+            _, response = results.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError()
+        finally:
+            connection.cancel(pending)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def _read_loop(self) -> None:
+        while not self._closed:
+            with self._lock:
+                connections = [c for c in self._connections.values() if not c.closed]
+            # Sleep until a connection may have become idle for too long, or for good when there is none.
+            timeout = min((c.last_used + self.idle_timeout for c in connections), default=None)
+            if timeout is not None:
+                timeout = max(timeout - time.monotonic(), 0)
+            try:
+                readable = select.select([self._wakeup, *(c.sock for c in connections)], [], [], timeout)[0]
+            except (OSError, ValueError):
+                continue
+            if self._wakeup in readable:
+                self._wakeup.clear()
+            for connection in connections:
+                if connection.sock in readable:
+                    connection.read()
+            self._close_idle()
+
+    def _close_idle(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            expired = [c for c in self._connections.values()
+                       if c.closed or (c.idle and now - c.last_used > self.idle_timeout)]
+            for connection in expired:
+                if self._connections.get(connection.address) is connection:
+                    self._connections.pop(connection.address)
+        for connection in expired:
+            if not connection.closed:
+                connection.close()
+
+    def close(self) -> None:
+        self._closed = True
+        if self._reader is not None:
+            self._wakeup.set()
+            if self._reader is not threading.current_thread():
+                self._reader.join()
+            self._wakeup.close()
+        with self._lock:
+            connections, self._connections = list(self._connections.values()), OrderedDict()
+        for connection in connections:
+            connection.close()
+
+    def __len__(self):
+        return len(self._connections)
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import contextlib
+import itertools
+import threading
+import time
+from enum import Enum
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+from config import UPSTREAM_MAX_FAILURES, UPSTREAM_EJECT_SECONDS, UPSTREAM_HEALTH_CHECK_INTERVAL_SECONDS
+from server_stats import ServerStatsTable
+
+
+class UpstreamPolicy(Enum):
+    """How a forwarding client chooses the upstream resolver for a query."""
+    ROUND_ROBIN = 'round-robin'
+    LEAST_OUTSTANDING = 'least-outstanding'
+    LOWEST_SRTT = 'lowest-srtt'
+
+
+class Upstream:
+    __slots__ = ('address', 'outstanding', 'failures', 'ejected_until')
+    address: str
+    outstanding: int
+    failures: int
+    ejected_until: Optional[float]
+
+    def __init__(self, address: str):
+        self.address = address
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = None
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until is not None and time.monotonic() < self.ejected_until
+
+    def __repr__(self):
+        return f"Upstream({self.address}, outstanding={self.outstanding}, failures={self.failures}, " \
+               f"ejected={self.ejected})"
+
+
+class UpstreamPool:
+    """Recursive resolvers a forwarding client sends its queries to.
+
+    Upstreams failing `max_failures` times in a row are ejected for `eject_time` seconds. While any upstream is
+    ejected, a background thread calls `probe` on it every `check_interval` seconds and readmits it as soon as a
+    probe succeeds. When every upstream is ejected they are still used, least recently ejected first, rather than
+    failing all queries.
+    """
+    policy: UpstreamPolicy
+    stats: ServerStatsTable
+    probe: Optional[Callable[[str], bool]]
+    max_failures: int
+    eject_time: float
+    check_interval: float
+    _upstreams: Dict[str, Upstream]
+    _checker: Optional[threading.Thread]
+
+    def __init__(self, addresses: Sequence[str], policy: UpstreamPolicy = UpstreamPolicy.LOWEST_SRTT,
+                 stats: Optional[ServerStatsTable] = None, probe: Optional[Callable[[str], bool]] = None,
+                 max_failures: int = UPSTREAM_MAX_FAILURES, eject_time: float = UPSTREAM_EJECT_SECONDS,
+                 check_interval: float = UPSTREAM_HEALTH_CHECK_INTERVAL_SECONDS):
+        if not addresses:
+            raise ValueError('at least one upstream is required')
+        self.policy = policy
+        self.stats = stats if stats is not None else ServerStatsTable()
+        self.probe = probe
+        self.max_failures = max_failures
+        self.eject_time = eject_time
+        self.check_interval = check_interval
+        self._upstreams = {address: Upstream(address) for address in addresses}
+        self._order = list(self._upstreams.values())
+        self._next = itertools.count()
+        self._checker = None
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+
+    def pick(self, exclude: Sequence[str] = ()) -> Optional[str]:
+        """Address of the upstream to query next, skipping `exclude`; None once every upstream is excluded."""
+        with self._lock:
+            candidates = [u for u in self._order if u.address not in exclude]
+            if not candidates:
+                return None
+            healthy = [u for u in candidates if not u.ejected]
+            if not healthy:
+                return min(candidates, key=lambda u: u.ejected_until).address
+            if self.policy is UpstreamPolicy.ROUND_ROBIN:
+                # Failover picks continue from the upstream the query started at instead of advancing the rotation.
+                start = self._order.index(self._upstreams[exclude[0]]) if exclude else next(self._next)
+                return min(healthy, key=lambda u: (self._order.index(u) - start) % len(self._order)).address
+            if self.policy is UpstreamPolicy.LEAST_OUTSTANDING:
+                return min(healthy, key=lambda u: (u.outstanding, self.stats.score(u.address))).address
+            return min(healthy, key=lambda u: (self.stats.score(u.address), u.outstanding)).address
+
+    @contextlib.contextmanager
+    def outstanding(self, address: str) -> Iterator[None]:
+        upstream = self._upstreams[address]
+        with self._lock:
+            upstream.outstanding += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                upstream.outstanding -= 1
+
+    def record_success(self, address: str) -> None:
+        upstream = self._upstreams[address]
+        with self._lock:
+            upstream.failures = 0
+            upstream.ejected_until = None
+
+    def record_failure(self, address: str) -> None:
+        upstream = self._upstreams[address]
+        with self._lock:
+            upstream.failures += 1
+            if upstream.failures < self.max_failures or upstream.ejected:
+                return
+            upstream.ejected_until = time.monotonic() + self.eject_time
+            if self.probe is not None and self._checker is None and not self._closed.is_set():
+                self._checker = threading.Thread(target=self._check_loop, daemon=True)
+                self._checker.start()
+
+    def health_check(self) -> None:
+        """Probes every ejected upstream once, readmitting those that answer and extending the ejection of the
+        others."""
+        with self._lock:
+            ejected = [u for u in self._order if u.ejected]
+        for upstream in ejected:
+            if self.probe(upstream.address):
+                self.record_success(upstream.address)
+            else:
+                with self._lock:
+                    upstream.ejected_until = time.monotonic() + self.eject_time
+
+    def _check_loop(self) -> None:
+        while not self._closed.wait(self.check_interval):
+            self.health_check()
+            with self._lock:
+                if not any(u.ejected for u in self._order):
+                    self._checker = None
+                    return
+
+    @property
+    def addresses(self) -> List[str]:
+        return [u.address for u in self._order]
+
+    @property
+    def healthy(self) -> List[str]:
+        with self._lock:
+            return [u.address for u in self._order if not u.ejected]
+
+    def close(self) -> None:
+        self._closed.set()
+
+    def __len__(self):
+        return len(self._order)
+
+    def __repr__(self):
+        return f"UpstreamPool({self.policy.value}, {self._order})"
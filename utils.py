@@ -1,9 +1,14 @@
+import asyncio
+import copy
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
 
-from config import MAX_RETRIES, MAX_RETRIES_PER_HOST
+from config import MAX_RETRIES, MAX_RETRIES_PER_HOST, MAX_AUTHORITY_ZONES, AUTHORITY_SWEEP_INTERVAL_SECONDS
 from models import DomainName
-from models.exceptions import RetrievalException, HostRetrievalException
+from models.exceptions import RetrievalException, HostRetrievalException, DeadlineExceededException
 from models.rrs import NS, SOA
 from request import Request
 from response import Response
@@ -17,15 +22,108 @@ def check_response(req: Request, resp: Response) -> bool:
     return True
 
 
-def check_tries(tries: int, host_tries: int, exc: Exception) -> bool:
+def check_tries(tries: int, host_tries: int, exc: Exception, max_host_tries: int = MAX_RETRIES_PER_HOST) -> bool:
     if tries > MAX_RETRIES:
         raise RetrievalException(f"Max retries exceeded") from exc
-    if host_tries > MAX_RETRIES_PER_HOST:
+    if host_tries > max_host_tries:
         raise HostRetrievalException(f"Max retries per host exceeded") from exc
     return True
 
 
+T = TypeVar('T')
+
+
+class Flight:
+    event: threading.Event
+    result: Any
+    error: Optional[BaseException]
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls with the same key: the first caller runs the call, the others wait for it.
+
+    Followers receive a shallow copy of the leader's result, so that they can rebind its attributes freely. Each
+    caller passes its own `timeout`; when the leader fails only because its deadline passed, a follower with time
+    left runs its own call instead of sharing that failure.
+    """
+    _flights: Dict[Hashable, Flight]
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], T], timeout: Optional[float] = None) -> T:
+        end = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Flight()
+            if leader:
+                break
+            remaining = end - time.monotonic() if end is not None else None
+            if remaining is not None and remaining <= 0 or not flight.event.wait(remaining):
+                raise DeadlineExceededException()
+            if isinstance(flight.error, DeadlineExceededException):
+                # Only the leader's deadline passed; take over if this caller has time left.
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return copy.copy(flight.result)
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key)
+            flight.event.set()
+
+    def __len__(self):
+        return len(self._flights)
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight; the shared call runs as a task, so a cancelled leader does not affect
+    the followers."""
+    _flights: Dict[Hashable, asyncio.Task]
+
+    def __init__(self):
+        self._flights = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout if timeout is not None else None
+        task = self._flights.get(key)
+        while task is not None and not task.done():
+            remaining = end - loop.time() if end is not None else None
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceededException()
+            try:
+                return copy.copy(await asyncio.wait_for(asyncio.shield(task), remaining))
+            except asyncio.TimeoutError:
+                raise DeadlineExceededException()
+            except DeadlineExceededException:
+                # Only the leader's deadline passed; take over if this caller has time left.
+                task = self._flights.get(key)
+        task = self._flights[key] = asyncio.ensure_future(fn())
+        task.add_done_callback(lambda t: self._flights.pop(key) if self._flights.get(key) is t else None)
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._flights)
+
+
 class Authority:
+    __slots__ = ('name', 'expiration', 'nsdname', 'address')
     name: DomainName
     expiration: datetime
     nsdname: DomainName
@@ -40,6 +138,10 @@ class Authority:
         self.nsdname = nsdname
         self.address = address
 
+    @property
+    def expired(self) -> bool:
+        return datetime.now() >= self.expiration
+
     @classmethod
     def from_ns(cls, authority: NS, address: Optional[str] = None):
         return cls(authority.name, authority.nsdname, address, authority.ttl)
@@ -62,3 +164,113 @@ class Authority:
         if isinstance(other, Authority):
             return self.nsdname == other.nsdname
         return False
+
+
+ZoneAuthorities = Tuple[Dict[DomainName, Authority], Dict[DomainName, Authority]]
+
+
+class AuthorityTable:
+    """Delegation table mapping zone names to their (known, unknown address) authorities.
+
+    Expired authorities are dropped lazily on lookup and by a periodic sweep, and the least recently used zones are
+    evicted once more than `max_zones` are stored. The root zone is never evicted.
+    """
+    max_zones: int
+    sweep_interval: timedelta
+    _zones: OrderedDict[DomainName, ZoneAuthorities]
+    _next_sweep: datetime
+
+    def __init__(self, max_zones: int = MAX_AUTHORITY_ZONES,
+                 sweep_interval: float = AUTHORITY_SWEEP_INTERVAL_SECONDS):
+        self.max_zones = max_zones
+        self.sweep_interval = timedelta(seconds=sweep_interval)
+        self._zones = OrderedDict()
+        self._next_sweep = datetime.now() + self.sweep_interval
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _purge(authorities: ZoneAuthorities) -> bool:
+        for d in authorities:
+            for name in [name for name, auth in d.items() if auth.expired]:
+                d.pop(name)
+        return any(authorities)
+
+    def get(self, zone: DomainName) -> Optional[ZoneAuthorities]:
+        with self._lock:
+            authorities = self._zones.get(zone)
+            if authorities is None:
+                return None
+            if not self._purge(authorities) and zone != DomainName(''):
+                del self._zones[zone]
+                return None
+            self._zones.move_to_end(zone)
+            return authorities
+
+    def setdefault(self, zone: DomainName) -> ZoneAuthorities:
+        with self._lock:
+            authorities = self.get(zone)
+            if authorities is None:
+                authorities = self._zones[zone] = ({}, {})
+                self._evict()
+            return authorities
+
+    def greatest_zone(self, name: DomainName) -> DomainName:
+        while True:
+            authorities = self.get(name)
+            if (authorities is not None and authorities[0]) or name == DomainName(''):
+                return name
+            name = name.parent()
+
+    def sweep(self) -> None:
+        with self._lock:
+            for zone in list(self._zones):
+                if not self._purge(self._zones[zone]) and zone != DomainName(''):
+                    del self._zones[zone]
+            self._next_sweep = datetime.now() + self.sweep_interval
+
+    def maybe_sweep(self) -> None:
+        if datetime.now() >= self._next_sweep:
+            self.sweep()
+
+    def zones(self) -> List[Tuple[DomainName, List[Authority]]]:
+        """Unexpired authorities of every zone, least recently used zone first."""
+        with self._lock:
+            return [(zone, [auth for d in authorities for auth in d.values() if not auth.expired])
+                    for zone, authorities in self._zones.items()]
+
+    def add(self, authority: Authority) -> None:
+        """Adds `authority` to its zone unless it is already known there."""
+        with self._lock:
+            known, unknown = self.setdefault(authority.name)
+            if authority.nsdname in known:
+                return
+            if authority.address is not None:
+                unknown.pop(authority.nsdname, None)
+                known[authority.nsdname] = authority
+            else:
+                unknown.setdefault(authority.nsdname, authority)
+
+    def _evict(self) -> None:
+        for zone in list(self._zones):
+            if len(self._zones) <= self.max_zones:
+                break
+            if zone != DomainName(''):
+                del self._zones[zone]
+
+    def __getitem__(self, zone: DomainName) -> ZoneAuthorities:
+        authorities = self.get(zone)
+        if authorities is None:
+            raise KeyError(zone)
+        return authorities
+
+    def __setitem__(self, zone: DomainName, authorities: ZoneAuthorities):
+        with self._lock:
+            self._zones[zone] = authorities
+            self._zones.move_to_end(zone)
+            self._evict()
+
+    def __contains__(self, zone: DomainName):
+        return self.get(zone) is not None
+
+    def __len__(self):
+        return len(self._zones)